@@ -1,2 +1,7 @@
-from .abstract_cache import AbstractCache, Seconds
+from .abstract_cache import AbstractCache, Seconds, MISSING
 from .redis_cache import RedisCache
+from .two_tier_cache import TwoTierCache
+from .redis_set_cache import RedisSetCache
+from .participants_cache import ParticipantsCache
+from .metrics import CacheMetrics
+from .memory_cache import MemoryCache
@@ -1,13 +1,33 @@
 from abc import ABC, abstractmethod
-from typing import Type
+from functools import cached_property
+from time import perf_counter
+from typing import AsyncIterator, Type
 
 from pydantic import BaseModel
 
 from cache.cachable import Cachable
+from cache.metrics import CacheMetrics
+from cache.schemas import AbstractScheme, get_scheme
+from cache.schemas.codecs import TOMBSTONE
+from cache.single_flight import SingleFlight, Loader
 
 Seconds = int
 
 
+class Missing:
+    """ Returned by get() for keys cached as absent (see AbstractScheme.negative_expire), falsy like None """
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = Missing()
+
+
 class AbstractCache(ABC):
     @abstractmethod
     async def connect(self, *args, **kwargs):
@@ -17,6 +37,10 @@ class AbstractCache(ABC):
     async def get[T](self, key: str | int, model: Type[BaseModel | Cachable]) -> T:
         pass
 
+    @abstractmethod
+    async def get_many[T](self, keys: list[str | int], model: Type[BaseModel | Cachable]) -> list[T | None]:
+        pass
+
     @abstractmethod
     async def set(self, obj: BaseModel | Cachable) -> None:
         pass
@@ -25,6 +49,11 @@ class AbstractCache(ABC):
     async def set_many(self, objs: list[BaseModel | Cachable]) -> None:
         pass
 
+    @abstractmethod
+    async def set_missing(self, key: str | int, model: Type[BaseModel | Cachable]) -> None:
+        """ Cache a tombstone for an absent object, the next set() replaces it """
+        pass
+
     @abstractmethod
     async def exists(self, obj: BaseModel | Cachable) -> bool:
         pass
@@ -33,6 +62,18 @@ class AbstractCache(ABC):
     async def delete(self, model: BaseModel | Cachable) -> None:
         pass
 
+    @abstractmethod
+    async def delete_many(self, keys: list[str | int], model: Type[BaseModel | Cachable]) -> None:
+        """ Delete objects by their ids, for callers that don't have the objects """
+        pass
+
+    @abstractmethod
+    async def invalidate_all(self, model: Type[BaseModel | Cachable]) -> None:
+        """ Drop every object of the model, other schemes stay intact.
+        O(1) for versioned schemes (AbstractScheme.versioned), a key scan otherwise
+        """
+        pass
+
     @abstractmethod
     async def clear(self) -> None:
         pass
@@ -45,6 +86,75 @@ class AbstractCache(ABC):
     async def get_all_keys(self) -> list[str]:
         pass
 
+    @abstractmethod
+    def iter_all[T](self, model: Type[BaseModel | Cachable], batch: int | None = None) -> AsyncIterator[T]:
+        pass
+
+    @abstractmethod
+    def iter_keys(self, pattern: str | None = None, batch: int | None = None) -> AsyncIterator[str]:
+        pass
+
     @abstractmethod
     async def get_raw(self, key: str) -> dict:
-        pass
\ No newline at end of file
+        pass
+
+    @cached_property
+    def metrics(self) -> CacheMetrics:
+        return CacheMetrics()
+
+    @cached_property
+    def _generations(self) -> dict[str, int]:
+        """ Current generations of versioned schemes by scheme key, 0 if absent """
+        return {}
+
+    def generation(self, scheme: AbstractScheme) -> int:
+        return self._generations.get(scheme.key, 0)
+
+    def _key(self, scheme: AbstractScheme, ID: int | str | BaseModel | Cachable) -> str:
+        """ Full key of an id or an object in the current generation of the scheme """
+        return scheme.getter(ID, self.generation(scheme))
+
+    def _decode(self, scheme: AbstractScheme, raw: bytes | None):
+        """ scheme.load() with timing and payload size """
+        if raw is None:
+            return None
+        if raw == TOMBSTONE:
+            # Every tombstone read is a source lookup saved
+            self.metrics.hit(scheme.key, "tombstone")
+            return MISSING
+        started = perf_counter()
+        obj = scheme.load(raw)
+        self.metrics.observe(scheme.key, "load", perf_counter() - started)
+        self.metrics.size(scheme.key, "load", len(raw))
+        return obj
+
+    def _encode(self, scheme: AbstractScheme, obj: BaseModel) -> bytes:
+        """ scheme.dump() with timing and payload size """
+        started = perf_counter()
+        raw = scheme.dump(obj)
+        self.metrics.observe(scheme.key, "dump", perf_counter() - started)
+        self.metrics.size(scheme.key, "dump", len(raw))
+        return raw
+
+    @cached_property
+    def _single_flight(self) -> SingleFlight:
+        return SingleFlight()
+
+    async def get_or_load[T](self, key: str | int, model: Type[BaseModel | Cachable], loader: Loader) -> T | None:
+        """ Cache-aside read: on miss calls loader() and caches its result.
+        Concurrent misses of the same key in this process share one loader call.
+        """
+        obj = await self.get(key, model)
+        if obj is MISSING:
+            return None
+        if obj is not None:
+            return obj
+        return await self._single_flight.do((model, key), lambda: self._load_and_set(key, model, loader))
+
+    async def _load_and_set(self, key: str | int, model: Type[BaseModel | Cachable], loader: Loader):
+        obj = await loader()
+        if obj is not None:
+            await self.set(obj)
+        elif get_scheme(model).negative_expire:
+            await self.set_missing(key, model)
+        return obj
@@ -0,0 +1,69 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+# Takes distinct keys, returns their values in the same order
+BatchFetch = Callable[[list], Awaitable[list]]
+
+
+class ReadBatcher:
+    """ DataLoader-style batching: keys requested during one loop iteration (or within `window` seconds)
+    are fetched together by one call, identical keys share one slot.
+    A batch is sent early once it holds max_batch keys.
+    """
+
+    def __init__(self, fetch: BatchFetch, window: float = 0, max_batch: int = 1000):
+        self._fetch = fetch
+        self._window = window
+        self._max_batch = max_batch
+        self._pending: dict[Hashable, asyncio.Future] = {}
+        self._handle: asyncio.Handle | None = None
+        self._background: set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable) -> Any:
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self._max_batch:
+                self._dispatch()
+            elif self._handle is None:
+                # call_soon runs after every callback already queued, i.e. after the other ready tasks
+                if self._window:
+                    self._handle = loop.call_later(self._window, self._dispatch)
+                else:
+                    self._handle = loop.call_soon(self._dispatch)
+        # Cancelling one caller must not cancel the read for the others
+        return await asyncio.shield(future)
+
+    def _dispatch(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._run(batch))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _run(self, batch: dict[Hashable, asyncio.Future]) -> None:
+        try:
+            values = await self._fetch(list(batch))
+        except BaseException as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        for future, value in zip(batch.values(), values):
+            if not future.done():
+                future.set_result(value)
+
+    def __len__(self) -> int:
+        """ Keys waiting for the next batch """
+        return len(self._pending)
+
+
+__all__ = [
+    "ReadBatcher",
+    "BatchFetch",
+]
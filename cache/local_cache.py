@@ -0,0 +1,56 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any
+
+from cache.abstract_cache import Seconds
+
+
+class LocalCache:
+    """ Size-bounded in-process LRU with per-entry TTL.
+    Not thread-safe, meant to be used from a single event loop.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        # Incremented on every invalidation, lets readers detect a race with pub/sub
+        self.invalidations: int = 0
+
+    def get(self, key: str) -> Any | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Seconds) -> None:
+        if ttl <= 0:
+            return
+        self._data[key] = (monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, *keys: str) -> None:
+        self.invalidations += 1
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self.invalidations += 1
+        self._data.clear()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+__all__ = [
+    "LocalCache",
+]
@@ -0,0 +1,214 @@
+import math
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from time import monotonic
+from typing import AsyncIterator, Type
+
+from pydantic import BaseModel
+
+from cache.abstract_cache import AbstractCache
+from cache.schemas import get_scheme
+from cache.schemas.codecs import loads_raw, TOMBSTONE
+
+
+class TimerWheel:
+    """ Hashed timing wheel: O(1) schedule/cancel, expiring costs only the elapsed slots.
+    Deadlines further than one rotation stay in their slot until their round comes.
+    """
+
+    def __init__(self, slots: int = 512, resolution: float = 1.0, now: float | None = None):
+        self._slots: list[dict[str, float]] = [dict() for _ in range(slots)]
+        self._resolution = resolution
+        self._tick = self._to_tick(monotonic() if now is None else now)
+
+    def _to_tick(self, moment: float) -> int:
+        return math.floor(moment / self._resolution)
+
+    def _slot(self, deadline: float) -> dict[str, float]:
+        return self._slots[math.ceil(deadline / self._resolution) % len(self._slots)]
+
+    def schedule(self, key: str, deadline: float) -> None:
+        self._slot(deadline)[key] = deadline
+
+    def cancel(self, key: str, deadline: float) -> None:
+        self._slot(deadline).pop(key, None)
+
+    def advance(self, now: float) -> list[str]:
+        """ Return keys whose deadline has passed """
+        tick = self._to_tick(now)
+        if tick <= self._tick:
+            return []
+        expired = []
+        for t in range(self._tick + 1, min(tick, self._tick + len(self._slots)) + 1):
+            slot = self._slots[t % len(self._slots)]
+            for key, deadline in list(slot.items()):
+                if deadline <= now:
+                    del slot[key]
+                    expired.append(key)
+        self._tick = tick
+        return expired
+
+    def clear(self) -> None:
+        for slot in self._slots:
+            slot.clear()
+
+
+class MemoryCache(AbstractCache):
+    """ In-process AbstractCache: same schemes, TTLs and serialization as RedisCache, without the network.
+    Values are kept serialized, so it also measures the schemes' load/dump cost on its own.
+    When max_bytes is exceeded the least recently used entries are evicted.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, wheel_slots: int = 512, resolution: float = 1.0):
+        self.max_bytes = max_bytes
+        # key -> (serialized value, deadline or None), ordered from least to most recently used
+        self._data: OrderedDict[str, tuple[bytes, float | None]] = OrderedDict()
+        self._wheel = TimerWheel(wheel_slots, resolution)
+        self.used_bytes = 0
+        self.evictions = 0
+
+    async def connect(self, *args, **kwargs):
+        pass
+
+    async def close(self):
+        await self.clear()
+
+    async def dispose(self):
+        await self.close()
+
+    def _expire(self) -> None:
+        for key in self._wheel.advance(monotonic()):
+            self._remove(key, cancel=False)
+
+    def _remove(self, key: str, cancel: bool = True) -> None:
+        item = self._data.pop(key, None)
+        if item is None:
+            return
+        raw, deadline = item
+        self.used_bytes -= len(key) + len(raw)
+        if cancel and deadline is not None:
+            self._wheel.cancel(key, deadline)
+
+    def _read(self, key: str) -> bytes | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        raw, deadline = item
+        # The wheel fires at slot granularity, so check the exact deadline too
+        if deadline is not None and deadline <= monotonic():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return raw
+
+    def _write(self, key: str, raw: bytes, ttl: int | None) -> None:
+        self._remove(key)
+        deadline = monotonic() + ttl if ttl is not None else None
+        self._data[key] = (raw, deadline)
+        self.used_bytes += len(key) + len(raw)
+        if deadline is not None:
+            self._wheel.schedule(key, deadline)
+        while self.used_bytes > self.max_bytes and self._data:
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def _set(self, obj: BaseModel) -> None:
+        scheme = get_scheme(obj.__class__)
+        self._write(self._key(scheme, obj), self._encode(scheme, obj), scheme.ttl(obj))
+
+    async def get[T](self, key: str | int, model: Type[BaseModel]) -> T | None:
+        self._expire()
+        scheme = get_scheme(model)
+        raw = self._read(self._key(scheme, key))
+        if raw is None:
+            self.metrics.miss(scheme.key, "get")
+            return None
+        self.metrics.hit(scheme.key, "get")
+        return self._decode(scheme, raw)
+
+    async def get_many[T](self, keys: list[str | int], model: Type[BaseModel]) -> list[T | None]:
+        self._expire()
+        scheme = get_scheme(model)
+        result = [self._decode(scheme, self._read(self._key(scheme, key))) for key in keys]
+        misses = result.count(None)
+        self.metrics.hit(scheme.key, "get_many", len(result) - misses)
+        self.metrics.miss(scheme.key, "get_many", misses)
+        return result
+
+    async def set(self, obj: BaseModel) -> None:
+        self._expire()
+        self._set(obj)
+
+    async def set_many(self, objs: list[BaseModel]) -> None:
+        self._expire()
+        for obj in objs:
+            self._set(obj)
+
+    async def set_missing(self, key: str | int, model: Type[BaseModel]) -> None:
+        scheme = get_scheme(model)
+        if not scheme.negative_expire:
+            raise ValueError(f"Negative caching is disabled for {model.__name__}")
+        self._expire()
+        self._write(self._key(scheme, key), TOMBSTONE, scheme.negative_expire)
+
+    async def exists(self, obj: BaseModel) -> bool:
+        self._expire()
+        return self._read(self._key(get_scheme(obj.__class__), obj)) not in (None, TOMBSTONE)
+
+    async def delete(self, model: BaseModel) -> None:
+        self._remove(self._key(get_scheme(model.__class__), model))
+
+    async def delete_many(self, keys: list[str | int], model: Type[BaseModel]) -> None:
+        scheme = get_scheme(model)
+        for key in keys:
+            self._remove(self._key(scheme, key))
+
+    async def invalidate_all(self, model: Type[BaseModel]) -> None:
+        scheme = get_scheme(model)
+        if scheme.versioned:
+            generation = self._generations[scheme.key] = self.generation(scheme) + 1
+            stale = [key for key in self._data if scheme.generation_of(key) not in (None, generation)]
+        else:
+            stale = [key for key in self._data if fnmatchcase(key, scheme.get_all())]
+        for key in stale:
+            self._remove(key)
+
+    async def clear(self) -> None:
+        self._data.clear()
+        self._wheel.clear()
+        self.used_bytes = 0
+
+    async def get_all(self, model: Type[BaseModel]) -> list[BaseModel]:
+        return [obj async for obj in self.iter_all(model)]
+
+    async def get_all_keys(self) -> list[str]:
+        return [key async for key in self.iter_keys()]
+
+    async def iter_all[T](self, model: Type[BaseModel], batch: int | None = None) -> AsyncIterator[T]:
+        scheme = get_scheme(model)
+        async for key in self.iter_keys(scheme.get_all(self.generation(scheme))):
+            raw = self._read(key)
+            if raw is not None and raw != TOMBSTONE:
+                yield self._decode(scheme, raw)
+
+    async def iter_keys(self, pattern: str | None = None, batch: int | None = None) -> AsyncIterator[str]:
+        self._expire()
+        # Snapshot, the consumer may modify the cache between items
+        for key in list(self._data):
+            if pattern is None or fnmatchcase(key, pattern):
+                yield key
+
+    async def get_raw(self, key: str) -> dict:
+        raw = self._read(key)
+        if not raw or raw == TOMBSTONE:
+            return dict()
+        return loads_raw(raw)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+__all__ = [
+    "MemoryCache",
+    "TimerWheel",
+]
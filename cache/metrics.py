@@ -0,0 +1,122 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator
+
+Labels = tuple[str, str]  # (scheme, operation)
+
+
+class Histogram:
+    """ Fixed-bucket histogram, buckets are upper bounds """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        result, total = [], 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "sum": self.sum, "buckets": dict(self.cumulative())}
+
+
+class CacheMetrics:
+    """ Hits, misses, errors, latencies and payload sizes per scheme and operation """
+    latency_buckets: tuple[float, ...] = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    )
+    size_buckets: tuple[float, ...] = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+    def __init__(self):
+        self.hits: dict[Labels, int] = defaultdict(int)
+        self.misses: dict[Labels, int] = defaultdict(int)
+        self.errors: dict[Labels, int] = defaultdict(int)
+        self.latency: dict[Labels, Histogram] = {}
+        self.sizes: dict[Labels, Histogram] = {}
+
+    def hit(self, scheme: str, operation: str, count: int = 1) -> None:
+        self.hits[scheme, operation] += count
+
+    def miss(self, scheme: str, operation: str, count: int = 1) -> None:
+        self.misses[scheme, operation] += count
+
+    def error(self, scheme: str, operation: str) -> None:
+        self.errors[scheme, operation] += 1
+
+    def observe(self, scheme: str, operation: str, seconds: float) -> None:
+        histogram = self.latency.get((scheme, operation))
+        if histogram is None:
+            histogram = self.latency[scheme, operation] = Histogram(self.latency_buckets)
+        histogram.observe(seconds)
+
+    def size(self, scheme: str, operation: str, size: int) -> None:
+        histogram = self.sizes.get((scheme, operation))
+        if histogram is None:
+            histogram = self.sizes[scheme, operation] = Histogram(self.size_buckets)
+        histogram.observe(size)
+
+    @contextmanager
+    def timer(self, scheme: str, operation: str) -> Iterator[None]:
+        """ Records latency of the block, and an error if it raises """
+        started = perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(scheme, operation)
+            raise
+        finally:
+            self.observe(scheme, operation, perf_counter() - started)
+
+    def hit_ratio(self, scheme: str, operation: str) -> float | None:
+        total = self.hits[scheme, operation] + self.misses[scheme, operation]
+        return self.hits[scheme, operation] / total if total else None
+
+    def reset(self) -> None:
+        self.__init__()
+
+    def snapshot(self) -> dict:
+        """ {scheme: {operation: {...}}} """
+        result: dict = defaultdict(lambda: defaultdict(dict))
+        for name, counter in (("hits", self.hits), ("misses", self.misses), ("errors", self.errors)):
+            for (scheme, operation), value in counter.items():
+                result[scheme][operation][name] = value
+        for name, histograms in (("latency", self.latency), ("bytes", self.sizes)):
+            for (scheme, operation), histogram in histograms.items():
+                result[scheme][operation][name] = histogram.snapshot()
+        return {scheme: dict(operations) for scheme, operations in result.items()}
+
+    def to_prometheus(self, prefix: str = "cache") -> str:
+        """ Prometheus text exposition format """
+        lines = []
+        for name, counter in (("hits", self.hits), ("misses", self.misses), ("errors", self.errors)):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for (scheme, operation), value in counter.items():
+                lines.append(f'{prefix}_{name}_total{{scheme="{scheme}",operation="{operation}"}} {value}')
+        for name, histograms in (("operation_seconds", self.latency), ("payload_bytes", self.sizes)):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for (scheme, operation), histogram in histograms.items():
+                labels = f'scheme="{scheme}",operation="{operation}"'
+                for bound, count in histogram.cumulative():
+                    lines.append(f'{prefix}_{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f"{prefix}_{name}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{prefix}_{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+__all__ = [
+    "CacheMetrics",
+    "Histogram",
+]
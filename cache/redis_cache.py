@@ -1,96 +1,460 @@
+import asyncio
 import json
+import math
+import random
 import sys
-from typing import Type
+from itertools import batched
+from time import monotonic
+from typing import AsyncIterator, Callable, Type
+from uuid import uuid4
 
 from loguru import logger
 from pydantic import BaseModel
 from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+from redis.asyncio.cluster import RedisCluster
 
-from cache import AbstractCache, Seconds
-from cache.schemas import AbstractScheme, schemas
+from cache.abstract_cache import AbstractCache, Seconds, MISSING
+from cache.batcher import ReadBatcher
+from cache.sharding import HashRing
+from cache.single_flight import Loader
+from cache.schemas import AbstractScheme, schemas, get_scheme
+from cache.schemas.codecs import loads_raw, TOMBSTONE
 from settings import RedisSettings
 
 
 class RedisCache(AbstractCache):
-    _redis: Redis
+    """ Redis-backed cache.
+    Runs on a single node, on several independent nodes (settings.REDIS_NODES, keys are spread by consistent
+    hashing of the key or its {hash tag}), or against a Redis Cluster (settings.REDIS_CLUSTER).
+    """
+    # The first node: pub/sub and other node-independent commands go here
+    _redis: Redis | RedisCluster
+    _nodes: list[Redis | RedisCluster]
+    _ring: HashRing
     _default_expire: Seconds = 120
+    # Cross-process loader lock for get_or_load
+    _lock_expire: Seconds = 5
+    _lock_poll_interval: float = 0.05
+    _release_lock_script = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    )
+    # Bumps of versioned scheme generations are announced here
+    generations_channel: str = "cache:generation"
+    _pubsub: PubSub | None = None
+    _generations_listener: asyncio.Task | None = None
 
-    def __init__(self, settings: RedisSettings):
+    def __init__(self, settings: RedisSettings, chunk_size: int = 1000, batch_window: float | None = None):
+        """ batch_window: when set, concurrent get() calls issued within this many seconds
+        (0 - within one event loop iteration) are sent together as one MGET per node
+        """
         self._settings = settings
+        # Max commands per pipeline / keys per MGET in bulk operations
+        self._chunk_size = chunk_size
+        self._background: set[asyncio.Task] = set()
+        self._batcher: ReadBatcher | None = None
+        if batch_window is not None:
+            self._batcher = ReadBatcher(self._fetch_raw, batch_window, chunk_size)
 
     async def connect(self):
 
         try:
-            self._redis = await Redis.from_url(self._settings.redis_url)
-            if not await self._redis.ping():
-                sys.exit("Failed to connect to Redis")
+            if self._settings.REDIS_CLUSTER:
+                # The cluster client routes every command by itself
+                urls = [self._settings.redis_url]
+                self._nodes = [await RedisCluster.from_url(self._settings.redis_url)]
+            else:
+                urls = self._settings.redis_urls
+                self._nodes = [await Redis.from_url(url) for url in urls]
+            for node in self._nodes:
+                if not await node.ping():
+                    sys.exit("Failed to connect to Redis")
+            self._redis = self._nodes[0]
+            self._ring = HashRing(urls)
+            self._release_lock = self._redis.register_script(self._release_lock_script)
+            await self._watch_generations()
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {e}")
             raise
 
+    @property
+    def client(self) -> Redis | RedisCluster:
+        return self._redis
+
+    def node(self, key: str) -> Redis | RedisCluster:
+        """ Return the client owning the key """
+        return self._nodes[self._ring.get(key)]
+
+    def _shard(self, keys: list[str]) -> dict[int, list[int]]:
+        """ Group key positions by node index """
+        shards: dict[int, list[int]] = {}
+        for i, key in enumerate(keys):
+            shards.setdefault(self._ring.get(key), []).append(i)
+        return shards
+
+    async def _mget(self, node: Redis | RedisCluster, keys: list) -> list[bytes | None]:
+        if isinstance(node, RedisCluster):
+            # Keys of one MGET may belong to different slots
+            return await node.mget_nonatomic(keys)
+        return await node.mget(keys)
+
     async def close(self):
-        if self._redis:
-            await self._redis.close()
+        if self._generations_listener:
+            self._generations_listener.cancel()
+            self._generations_listener = None
+        if self._pubsub:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        for node in getattr(self, "_nodes", []):
+            await node.aclose()
 
     async def get[T](self, key: str | int, model: Type[BaseModel]) -> T | None:
         scheme: AbstractScheme = schemas.get(model)
         if not scheme:
             raise NotImplementedError(f"Scheme not found for {model.__name__}")
-        raw = await self._redis.get(scheme.getter(key))
-        return scheme.load(raw)
+        with self.metrics.timer(scheme.key, "get"):
+            full_key = self._key(scheme, key)
+            if self._batcher is not None:
+                raw = await self._batcher.load(full_key)
+            else:
+                raw = await self.node(full_key).get(full_key)
+        if raw is None:
+            self.metrics.miss(scheme.key, "get")
+            return None
+        self.metrics.hit(scheme.key, "get")
+        return self._decode(scheme, raw)
 
     async def set(self, obj: BaseModel):
         scheme: AbstractScheme = schemas.get(obj.__class__)
         if not scheme:
             raise NotImplementedError(f"Scheme not found for {obj.__class__}")
-        await self._redis.set(
-            scheme.get_key(obj),
-            scheme.dump(obj),
-            ex=scheme.expire(obj),
-        )
+        key, raw = self._key(scheme, obj), self._encode(scheme, obj)
+        with self.metrics.timer(scheme.key, "set"):
+            await self.node(key).set(key, raw, ex=scheme.ttl(obj))
+
+    async def get_many[T](self, keys: list[str | int], model: Type[BaseModel]) -> list[T | None]:
+        """ Return objects in the order of keys, None for misses. Shards are queried in parallel """
+        scheme = get_scheme(model)
+        with self.metrics.timer(scheme.key, "get_many"):
+            raws = await self._fetch_raw([self._key(scheme, key) for key in keys])
+        result = [self._decode(scheme, raw) for raw in raws]
+        misses = result.count(None)
+        self.metrics.hit(scheme.key, "get_many", len(result) - misses)
+        self.metrics.miss(scheme.key, "get_many", misses)
+        return result
+
+    async def _fetch_raw(self, keys: list[str]) -> list[bytes | None]:
+        """ MGET of any keys: chunked, shards in parallel """
+        raws: list[bytes | None] = [None] * len(keys)
+
+        async def fetch(node: Redis | RedisCluster, positions: list[int]):
+            for chunk in batched(positions, self._chunk_size):
+                for i, raw in zip(chunk, await self._mget(node, [keys[i] for i in chunk])):
+                    raws[i] = raw
+
+        await asyncio.gather(*(fetch(self._nodes[index], positions) for index, positions in self._shard(keys).items()))
+        return raws
 
     async def set_many(self, objs: list[BaseModel]):
-        if not objs:
-            return
-        scheme: AbstractScheme = schemas.get(objs[0].__class__)
-        if not scheme:
-            raise NotImplementedError(f"Scheme not found for {objs[0].__class__}")
-        await self._redis.mset(
-            {scheme.get_key(obj): scheme.dump(obj) for obj in objs},
-        )
-        for obj in objs:
-            await self._redis.expire(scheme.get_key(obj), scheme.expire(obj))
+        """ Writes values with their own TTLs, one pipelined round trip per chunk, shards in parallel """
+        keys = [self._key(get_scheme(obj.__class__), obj) for obj in objs]
+
+        async def store(node: Redis | RedisCluster, positions: list[int]):
+            for chunk in batched(positions, self._chunk_size):
+                async with node.pipeline(transaction=False) as pipe:
+                    for i in chunk:
+                        scheme = get_scheme(objs[i].__class__)
+                        pipe.set(keys[i], self._encode(scheme, objs[i]), ex=scheme.ttl(objs[i]))
+                    await pipe.execute()
+
+        # Objects may belong to different schemes
+        with self.metrics.timer("*", "set_many"):
+            await asyncio.gather(*(store(self._nodes[index], positions) for index, positions in self._shard(keys).items()))
+
+    async def set_missing(self, key: str | int, model: Type[BaseModel]):
+        scheme = get_scheme(model)
+        if not scheme.negative_expire:
+            raise ValueError(f"Negative caching is disabled for {model.__name__}")
+        full_key = self._key(scheme, key)
+        with self.metrics.timer(scheme.key, "set_missing"):
+            await self.node(full_key).set(full_key, TOMBSTONE, ex=scheme.negative_expire)
 
     async def exists(self, obj: BaseModel) -> bool:
         scheme: AbstractScheme = schemas.get(obj.__class__)
         if not scheme:
             raise NotImplementedError(f"Scheme not found for {obj.__name__}")
-        return bool(await self._redis.exists(scheme.getter(obj)))
+        key = self._key(scheme, obj)
+        with self.metrics.timer(scheme.key, "exists"):
+            if scheme.negative_expire:
+                # A tombstone key exists, but the object does not
+                return await self.node(key).get(key) not in (None, TOMBSTONE)
+            return bool(await self.node(key).exists(key))
 
     async def delete(self, model: BaseModel):
         scheme: AbstractScheme = schemas.get(model.__class__)
         if not scheme:
             raise NotImplementedError(f"Scheme not found for {model.__class__}")
-        await self._redis.delete(scheme.get_key(model))
+        key = self._key(scheme, model)
+        with self.metrics.timer(scheme.key, "delete"):
+            await self.node(key).delete(key)
+
+    async def delete_many(self, keys: list[str | int], model: Type[BaseModel]):
+        scheme = get_scheme(model)
+        full_keys = [self._key(scheme, key) for key in keys]
+        with self.metrics.timer(scheme.key, "delete_many"):
+            await asyncio.gather(*(
+                self._nodes[index].unlink(*(full_keys[i] for i in positions))
+                for index, positions in self._shard(full_keys).items()
+            ))
+
+    async def invalidate_all(self, model: Type[BaseModel]):
+        """ Versioned schemes: the generation is bumped and announced to other processes,
+        keys of older generations are purged in background (they would expire anyway).
+        Others: SCAN + UNLINK of the scheme keys
+        """
+        scheme = get_scheme(model)
+        if not scheme.versioned:
+            with self.metrics.timer(scheme.key, "invalidate_all"):
+                await self._unlink_matching(scheme.get_all())
+            return
+        key = self._generation_key(scheme)
+        with self.metrics.timer(scheme.key, "invalidate_all"):
+            generation = await self.node(key).incr(key)
+            self._set_generation(scheme, generation)
+            await self._redis.publish(self.generations_channel, json.dumps([scheme.key, generation]))
+        task = asyncio.create_task(self._unlink_matching(
+            scheme.get_all_generations(),
+            lambda k: scheme.generation_of(k) is not None and scheme.generation_of(k) < generation,
+        ))
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    async def _unlink_matching(self, pattern: str, predicate: Callable[[str], bool] | None = None):
+        for node in self._nodes:
+            keys: list[bytes] = []
+            async for key in node.scan_iter(match=pattern, count=self._chunk_size):
+                if predicate is None or predicate(key.decode()):
+                    keys.append(key)
+                if len(keys) >= self._chunk_size:
+                    await node.unlink(*keys)
+                    keys = []
+            if keys:
+                await node.unlink(*keys)
+
+    @staticmethod
+    def _generation_key(scheme: AbstractScheme) -> str:
+        """ Kept outside the scheme namespace """
+        return f"generation:{scheme.key}"
+
+    def _set_generation(self, scheme: AbstractScheme, generation: int) -> None:
+        # Redis is authoritative: the counter may start over, e.g. after FLUSHDB
+        self._generations[scheme.key] = generation
+
+    async def _load_generations(self):
+        for scheme in schemas.values():
+            if scheme.versioned:
+                key = self._generation_key(scheme)
+                self._set_generation(scheme, int(await self.node(key).get(key) or 0))
+
+    async def _watch_generations(self):
+        """ Load generations of versioned schemes and follow their bumps """
+        if not any(scheme.versioned for scheme in schemas.values()):
+            return
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.generations_channel)
+        # Subscribed first, so a bump between the load and the subscription is not lost
+        await self._load_generations()
+        self._generations_listener = asyncio.create_task(self._listen_generations())
+
+    async def _listen_generations(self):
+        versioned = {scheme.key: scheme for scheme in schemas.values() if scheme.versioned}
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    key, generation = json.loads(message["data"])
+                    if key in versioned:
+                        self._set_generation(versioned[key], generation)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Bumps may have been missed while disconnected
+                logger.warning(f"Cache generation listener failed: {e}")
+                await asyncio.sleep(1)
+                try:
+                    await self._load_generations()
+                except Exception as e:
+                    logger.warning(f"Failed to reload cache generations: {e}")
 
     async def clear(self):
-        await self._redis.flushdb()
+        for node in self._nodes:
+            await node.flushdb()
+        await self._reseed_generations()
+
+    async def _reseed_generations(self):
+        """ FLUSHDB drops the generation counters: a fresh process would start over at 0 while
+        running ones stay where they were. Put the current generations back and announce them
+        """
+        for scheme in schemas.values():
+            generation = self.generation(scheme)
+            if not scheme.versioned or not generation:
+                continue
+            key = self._generation_key(scheme)
+            await self.node(key).set(key, generation)
+            await self._redis.publish(self.generations_channel, json.dumps([scheme.key, generation]))
 
     async def dispose(self):
-        await self._redis.close()
+        await self.close()
 
     async def get_all(self, model: Type[BaseModel]) -> list[BaseModel]:
-        scheme: AbstractScheme = schemas.get(model)
-        if not scheme:
-            raise NotImplementedError(f"Scheme not found for {model.__name__}")
-        ids = await self._redis.keys(scheme.get_all())
-        return [scheme.load(obj) for obj in await self._redis.mget(ids)]
+        """ Shards are scanned in parallel """
+        scheme = get_scheme(model)
+        shards = await asyncio.gather(*(
+            self._collect(self._iter_node(node, scheme, self._chunk_size)) for node in self._nodes
+        ))
+        return [obj for shard in shards for obj in shard]
+
+    @staticmethod
+    async def _collect[T](iterator: AsyncIterator[T]) -> list[T]:
+        return [item async for item in iterator]
 
     async def get_all_keys(self) -> list[str]:
-        return [k.decode() for k in await self._redis.keys()]
+        # SCAN may return a key more than once
+        return list(dict.fromkeys([key async for key in self.iter_keys()]))
+
+    async def iter_all[T](self, model: Type[BaseModel], batch: int | None = None) -> AsyncIterator[T]:
+        """ Streams objects of the model: SCAN by the scheme pattern, MGET per batch of keys.
+        Every key is loaded once, keys expired between SCAN and MGET are skipped.
+        """
+        scheme = get_scheme(model)
+        for node in self._nodes:
+            async for obj in self._iter_node(node, scheme, batch or self._chunk_size):
+                yield obj
+
+    async def _iter_node(self, node: Redis | RedisCluster, scheme: AbstractScheme, batch: int) -> AsyncIterator:
+        keys: list[bytes] = []
+        # SCAN may return a key more than once
+        seen: set[bytes] = set()
+        async for key in node.scan_iter(match=scheme.get_all(self.generation(scheme)), count=batch):
+            if key in seen:
+                continue
+            seen.add(key)
+            keys.append(key)
+            if len(keys) >= batch:
+                for obj in await self._load_existing(node, scheme, keys):
+                    yield obj
+                keys = []
+        for obj in await self._load_existing(node, scheme, keys):
+            yield obj
+
+    async def _load_existing(self, node: Redis | RedisCluster, scheme: AbstractScheme, keys: list[bytes]) -> list:
+        if not keys:
+            return []
+        with self.metrics.timer(scheme.key, "get_all"):
+            raws = await self._mget(node, keys)
+        return [self._decode(scheme, raw) for raw in raws if raw is not None and raw != TOMBSTONE]
+
+    async def iter_keys(self, pattern: str | None = None, batch: int | None = None) -> AsyncIterator[str]:
+        """ Streams keys matching the pattern without blocking Redis like KEYS does """
+        for node in self._nodes:
+            async for key in node.scan_iter(match=pattern, count=batch or self._chunk_size):
+                yield key.decode()
+
+    async def get_or_load[T](
+            self,
+            key: str | int,
+            model: Type[BaseModel],
+            loader: Loader,
+            beta: float = 1.0,
+    ) -> T | None:
+        """ Cache-aside read protected from stampedes.
+        Misses share one loader call per process and a short Redis lock across processes.
+        Hits are refreshed in background before expiry with XFetch probability (beta > 1 favors earlier
+        refresh), or once the value is past expire() but still within the scheme stale_expire window.
+        """
+        scheme = get_scheme(model)
+        full_key = self._key(scheme, key)
+        # Helper keys of a value are kept on its node
+        async with self.node(full_key).pipeline(transaction=False) as pipe:
+            pipe.get(full_key).pttl(full_key).get(self._delta_key(full_key))
+            with self.metrics.timer(scheme.key, "get_or_load"):
+                raw, pttl, delta = await pipe.execute()
+        if raw is None:
+            self.metrics.miss(scheme.key, "get_or_load")
+            return await self._single_flight.do(full_key, lambda: self._load(scheme, full_key, loader, wait=True))
+        if raw == TOMBSTONE:
+            self._decode(scheme, raw)
+            return None
+        if pttl > 0:
+            fresh_ms = pttl - scheme.stale_expire * 1000
+            delta_ms = float(delta or 0)
+            if fresh_ms <= 0 or -delta_ms * beta * math.log(1 - random.random()) >= fresh_ms:
+                self._refresh(scheme, full_key, loader)
+        self.metrics.hit(scheme.key, "get_or_load")
+        return self._decode(scheme, raw)
+
+    @staticmethod
+    def _delta_key(key: str) -> str:
+        """ Stores how long the last load took, kept outside the scheme namespace """
+        return f"xfetch:{key}"
+
+    def _refresh(self, scheme: AbstractScheme, key: str, loader: Loader) -> None:
+        if key in self._single_flight:
+            return
+        task = asyncio.create_task(self._single_flight.do(key, lambda: self._load(scheme, key, loader, wait=False)))
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Background cache task failed: {task.exception()}")
+
+    async def _load(self, scheme: AbstractScheme, key: str, loader: Loader, wait: bool):
+        """ Calls loader under the Redis lock, if the lock is taken waits for its holder (or gives up) """
+        node, lock_key, token = self.node(key), f"lock:{key}", uuid4().hex
+        if not await node.set(lock_key, token, nx=True, ex=self._lock_expire):
+            if not wait:
+                return None
+            obj = await self._wait_for(node, scheme, key, lock_key)
+            if obj is MISSING:
+                # The holder found nothing and cached that
+                return None
+            if obj is not None:
+                return obj
+        try:
+            started = monotonic()
+            with self.metrics.timer(scheme.key, "loader"):
+                obj = await loader()
+            if obj is None:
+                if scheme.negative_expire:
+                    await node.set(key, TOMBSTONE, ex=scheme.negative_expire)
+                return None
+            ttl = scheme.ttl(obj)
+            async with node.pipeline(transaction=False) as pipe:
+                pipe.set(key, self._encode(scheme, obj), ex=ttl)
+                pipe.set(self._delta_key(key), max(int((monotonic() - started) * 1000), 1), ex=ttl)
+                await pipe.execute()
+            return obj
+        finally:
+            await self._release_lock(keys=[lock_key], args=[token], client=node)
+
+    async def _wait_for(self, node: Redis | RedisCluster, scheme: AbstractScheme, key: str, lock_key: str):
+        """ Return the value written by the lock holder, MISSING for a tombstone, None if it didn't write one """
+        deadline = monotonic() + self._lock_expire
+        while monotonic() < deadline:
+            await asyncio.sleep(self._lock_poll_interval)
+            async with node.pipeline(transaction=False) as pipe:
+                raw, locked = await pipe.get(key).exists(lock_key).execute()
+            if raw == TOMBSTONE:
+                return MISSING
+            if raw is not None:
+                return self._decode(scheme, raw)
+            if not locked:
+                break
+        return None
 
     async def get_raw(self, key: str) -> dict:
-        data = await self._redis.get(key)
-        if not data:
+        data = await self.node(key).get(key)
+        if not data or data == TOMBSTONE:
             return dict()
-        return json.loads(await self._redis.get(key))
\ No newline at end of file
+        return loads_raw(data)
\ No newline at end of file
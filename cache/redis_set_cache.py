@@ -0,0 +1,62 @@
+from typing import AsyncIterator, Type
+
+from cache.redis_cache import RedisCache
+from cache.schemas.set_scheme import AbstractSetScheme
+
+
+class RedisSetCache[T]:
+    """ Atomic membership operations on native Redis SETs described by a set scheme """
+
+    def __init__(self, cache: RedisCache, scheme: Type[AbstractSetScheme[T]]):
+        self._cache = cache
+        self.scheme = scheme
+
+    async def add(self, owner_id: int | str, *members: T) -> int:
+        """ Return the number of members that were not in the set yet """
+        key = self.scheme.getter(owner_id)
+        expire = self.scheme.expire(owner_id)
+        async with self._cache.node(key).pipeline(transaction=True) as pipe:
+            pipe.sadd(key, *(self.scheme.dump_member(member) for member in members))
+            if expire:
+                pipe.expire(key, expire)
+            added, *_ = await pipe.execute()
+        return added
+
+    async def remove(self, owner_id: int | str, *members: T) -> int:
+        key = self.scheme.getter(owner_id)
+        return await self._cache.node(key).srem(key, *(self.scheme.dump_member(member) for member in members))
+
+    async def contains(self, owner_id: int | str, member: T) -> bool:
+        key = self.scheme.getter(owner_id)
+        return bool(await self._cache.node(key).sismember(key, self.scheme.dump_member(member)))
+
+    async def count(self, owner_id: int | str) -> int:
+        key = self.scheme.getter(owner_id)
+        return await self._cache.node(key).scard(key)
+
+    async def sample(self, owner_id: int | str, k: int) -> list[T]:
+        """ Return up to k distinct random members, leaving them in the set """
+        key = self.scheme.getter(owner_id)
+        raws = await self._cache.node(key).srandmember(key, k)
+        return [self.scheme.load_member(raw) for raw in raws]
+
+    async def pop(self, owner_id: int | str, k: int) -> list[T]:
+        """ Remove and return up to k distinct random members """
+        key = self.scheme.getter(owner_id)
+        raws = await self._cache.node(key).spop(key, k)
+        return [self.scheme.load_member(raw) for raw in raws or []]
+
+    async def members(self, owner_id: int | str, batch: int = 1000) -> AsyncIterator[T]:
+        """ Streams members with SSCAN """
+        key = self.scheme.getter(owner_id)
+        async for raw in self._cache.node(key).sscan_iter(key, count=batch):
+            yield self.scheme.load_member(raw)
+
+    async def delete(self, owner_id: int | str) -> None:
+        key = self.scheme.getter(owner_id)
+        await self._cache.node(key).unlink(key)
+
+
+__all__ = [
+    "RedisSetCache",
+]
@@ -1,2 +1,3 @@
 from .abstract_scheme import AbstractScheme
-from .schemas import schemas
+from .schemas import schemas, get_scheme
+from .set_scheme import AbstractSetScheme
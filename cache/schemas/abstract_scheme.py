@@ -3,12 +3,28 @@ from typing import Type
 
 from pydantic import BaseModel
 
+from lib.cache.schemas.codecs import Codec, Compression, PydanticJsonCodec, pack, unpack
 from lib.models import Cachable
 
 
 class AbstractScheme[T](ABC):
     model: Type[BaseModel]
     key: str
+    # Lifetime in the in-process L1 cache, capped by expire(); None disables L1 for the scheme
+    local_expire: int | None = None
+    # Extra lifetime during which get_or_load serves the stale value and refreshes it in background
+    stale_expire: int = 0
+    # Lifetime of a tombstone cached for a missing object; None disables negative caching
+    negative_expire: int | None = None
+    # Wrap the key in a {hash tag}: all objects of the scheme live on one shard / cluster slot
+    colocate: bool = False
+    # Prefix keys with a generation number, so invalidate_all() drops the whole scheme in O(1).
+    # The current generation is kept by every cache instance (AbstractCache.generation)
+    versioned: bool = False
+    # Serialization of values, compression is applied to payloads of at least compress_min_size bytes
+    codec: Type[Codec] = PydanticJsonCodec
+    compression: Type[Compression] | None = None
+    compress_min_size: int = 1024
 
     def __init_subclass__(cls, **kwargs):
         if not cls.model:
@@ -22,6 +38,11 @@ class AbstractScheme[T](ABC):
         """ Return the expiration time in seconds """
         pass
 
+    @classmethod
+    def ttl(cls, obj: T) -> int:
+        """ Return the lifetime in Redis: expire() plus the stale window """
+        return cls.expire(obj) + cls.stale_expire
+
     @classmethod
     @abstractmethod
     def get_key(cls, obj: T) -> str:
@@ -29,27 +50,67 @@ class AbstractScheme[T](ABC):
         pass
 
     @classmethod
-    def load(cls, serialized_obj_data: str) -> T | None:
+    def load(cls, serialized_obj_data: bytes | str | None) -> T | None:
         """ Return the object from the serialized data """
         if not serialized_obj_data:
             return None
+        if isinstance(serialized_obj_data, str):
+            serialized_obj_data = serialized_obj_data.encode()
+        codec, payload = unpack(serialized_obj_data)
+        if codec:
+            return codec.decode(payload, cls.model)
+        # Values stored as plain JSON before codecs were introduced
         if issubclass(cls.model, BaseModel):
-            return cls.model.model_validate_json(serialized_obj_data)
+            return cls.model.model_validate_json(payload)
         if issubclass(cls.model, Cachable):
-            return cls.model.from_json(serialized_obj_data)
+            return cls.model.from_json(payload)
         raise NotImplementedError(f"Scheme not found for {cls.model.__name__}")
 
     @classmethod
-    @abstractmethod
-    def dump(cls, obj: T) -> str:
-        pass
+    def dump(cls, obj: T) -> bytes:
+        """ Return the serialized object with the codec header """
+        payload = cls.codec.encode(obj)
+        if cls.compression and len(payload) >= cls.compress_min_size:
+            return pack(payload, cls.codec, cls.compression)
+        return pack(payload, cls.codec)
 
     @classmethod
-    def getter(cls, ID: int | str | T):
+    def base_namespace(cls) -> str:
+        """ Return the prefix of keys of every generation """
+        if cls.colocate:
+            return f'{{{cls.key}}}'
+        return cls.key
+
+    @classmethod
+    def namespace(cls, generation: int = 0) -> str:
+        """ Return the prefix of all keys of the scheme in the generation """
+        if cls.versioned:
+            return f'{cls.base_namespace()}:v{generation}'
+        return cls.base_namespace()
+
+    @classmethod
+    def generation_of(cls, key: str) -> int | None:
+        """ Return the generation of a versioned key, None if it doesn't belong to the scheme """
+        prefix = f'{cls.base_namespace()}:v'
+        if not key.startswith(prefix):
+            return None
+        generation = key[len(prefix):].split(':', 1)[0]
+        return int(generation) if generation.isdigit() else None
+
+    @classmethod
+    def getter(cls, ID: int | str | T, generation: int = 0):
         if isinstance(ID, (int, str)):
-            return f'{cls.key}:{ID}'
-        return cls.get_key(ID)
+            return f'{cls.namespace(generation)}:{ID}'
+        key = cls.get_key(ID)
+        if generation:
+            # get_key() builds the key of generation 0
+            key = cls.namespace(generation) + key[len(cls.namespace()):]
+        return key
+
+    @classmethod
+    def get_all(cls, generation: int = 0):
+        return f'{cls.namespace(generation)}:*'
 
     @classmethod
-    def get_all(cls):
-        return f'{cls.key}:*'
+    def get_all_generations(cls):
+        return f'{cls.base_namespace()}:v*'
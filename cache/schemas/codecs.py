@@ -0,0 +1,191 @@
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Type
+
+import pydantic_core
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+# Values written by codecs start with a header byte with the high bit set:
+# 0b1CCCIIII, where CCC is the compression id and IIII is the codec id.
+# JSON never starts with such a byte, so values stored before codecs still load.
+HEADER_FLAG = 0x80
+# Negative-cache marker: the key is known to be absent in the source of truth
+TOMBSTONE = b"\x00"
+
+
+class Codec(ABC):
+    """ Turns cached objects into bytes and back """
+    id: int
+
+    @classmethod
+    def encode(cls, obj: Any) -> bytes:
+        if isinstance(obj, BaseModel):
+            return cls.dumps(obj.model_dump(mode="json", by_alias=True))
+        return cls.dumps(obj.to_dict())
+
+    @classmethod
+    def decode(cls, data: bytes, model: Type) -> Any:
+        if issubclass(model, BaseModel):
+            return model.model_validate(cls.loads(data))
+        return model.from_dict(cls.loads(data))
+
+    @classmethod
+    @abstractmethod
+    def dumps(cls, data: Any) -> bytes:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def loads(cls, data: bytes) -> Any:
+        pass
+
+
+class PydanticJsonCodec(Codec):
+    """ JSON straight from/to bytes by pydantic-core, no intermediate dict for models """
+    id = 1
+
+    @classmethod
+    def encode(cls, obj: Any) -> bytes:
+        if isinstance(obj, BaseModel):
+            return pydantic_core.to_json(obj, by_alias=True)
+        return super().encode(obj)
+
+    @classmethod
+    def decode(cls, data: bytes, model: Type) -> Any:
+        if issubclass(model, BaseModel):
+            return model.model_validate_json(data)
+        return super().decode(data, model)
+
+    @classmethod
+    def dumps(cls, data: Any) -> bytes:
+        return pydantic_core.to_json(data)
+
+    @classmethod
+    def loads(cls, data: bytes) -> Any:
+        return pydantic_core.from_json(data)
+
+
+class OrjsonCodec(Codec):
+    """ Requires orjson """
+    id = 2
+
+    @classmethod
+    def dumps(cls, data: Any) -> bytes:
+        return orjson.dumps(data)
+
+    @classmethod
+    def loads(cls, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """ Requires msgpack """
+    id = 3
+
+    @classmethod
+    def dumps(cls, data: Any) -> bytes:
+        return msgpack.packb(data)
+
+    @classmethod
+    def loads(cls, data: bytes) -> Any:
+        return msgpack.unpackb(data)
+
+
+class Compression(ABC):
+    id: int
+
+    @classmethod
+    @abstractmethod
+    def compress(cls, data: bytes) -> bytes:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def decompress(cls, data: bytes) -> bytes:
+        pass
+
+
+class Zlib(Compression):
+    id = 1
+    level: int = 1
+
+    @classmethod
+    def compress(cls, data: bytes) -> bytes:
+        return zlib.compress(data, cls.level)
+
+    @classmethod
+    def decompress(cls, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class Lz4(Compression):
+    """ Requires lz4 """
+    id = 2
+
+    @classmethod
+    def compress(cls, data: bytes) -> bytes:
+        return lz4.compress(data)
+
+    @classmethod
+    def decompress(cls, data: bytes) -> bytes:
+        return lz4.decompress(data)
+
+
+codecs: dict[int, Type[Codec]] = {codec.id: codec for codec in (PydanticJsonCodec, OrjsonCodec, MsgpackCodec)}
+compressions: dict[int, Type[Compression]] = {compression.id: compression for compression in (Zlib, Lz4)}
+
+
+def pack(payload: bytes, codec: Type[Codec], compression: Type[Compression] | None = None) -> bytes:
+    """ Prepend the header byte, compressing the payload if compression is given """
+    if compression:
+        payload = compression.compress(payload)
+        return bytes((HEADER_FLAG | compression.id << 4 | codec.id,)) + payload
+    return bytes((HEADER_FLAG | codec.id,)) + payload
+
+
+def unpack(data: bytes) -> tuple[Type[Codec] | None, bytes]:
+    """ Return the codec and the decompressed payload, codec is None for legacy JSON values """
+    if not data or not data[0] & HEADER_FLAG:
+        return None, data
+    header = data[0]
+    payload = data[1:]
+    compression_id = header >> 4 & 0b111
+    if compression_id:
+        payload = compressions[compression_id].decompress(payload)
+    return codecs[header & 0b1111], payload
+
+
+def loads_raw(data: bytes) -> Any:
+    """ Decode a stored value into plain python data without knowing its scheme """
+    codec, payload = unpack(data)
+    return (codec or PydanticJsonCodec).loads(payload)
+
+
+__all__ = [
+    "Codec",
+    "PydanticJsonCodec",
+    "OrjsonCodec",
+    "MsgpackCodec",
+    "Compression",
+    "Zlib",
+    "Lz4",
+    "pack",
+    "unpack",
+    "loads_raw",
+    "TOMBSTONE",
+]
@@ -1,6 +1,6 @@
-from json import dumps
-
 from lib.cache.schemas.abstract_scheme import AbstractScheme
+from lib.cache.schemas.codecs import Zlib
+from lib.cache.schemas.set_scheme import AbstractSetScheme
 
 from lib.models import *
 from lib.utils import DateTimeUtils, day_in_seconds
@@ -12,11 +12,7 @@ class ParticipationScheme(AbstractScheme[ParticipationMessage]):
 
     @classmethod
     def get_key(cls, obj: ParticipationMessage):
-        return f'{cls.key}:{obj.user_id}'
-
-    @classmethod
-    def dump(cls, obj: ParticipationMessage):
-        return dumps(obj.model_dump(by_alias=True))
+        return cls.getter(obj.user_id)
 
     @classmethod
     def expire(cls, obj: ParticipationMessage) -> int:
@@ -26,14 +22,13 @@ class ParticipationScheme(AbstractScheme[ParticipationMessage]):
 class GiveawayScheme(AbstractScheme[Giveaway]):
     model = Giveaway
     key = "giveaway"
+    local_expire = 10
+    negative_expire = 30
+    versioned = True
 
     @classmethod
     def get_key(cls, obj: Giveaway):
-        return f'{cls.key}:{obj.id}'
-
-    @classmethod
-    def dump(cls, obj: Giveaway):
-        return dumps(obj.model_dump(by_alias=True))
+        return cls.getter(obj.id)
 
     @classmethod
     def expire(cls, obj: Giveaway) -> int:
@@ -49,14 +44,12 @@ class GiveawayScheme(AbstractScheme[Giveaway]):
 class ChannelScheme(AbstractScheme[ChannelInfo]):
     model = ChannelInfo
     key = "channel"
+    local_expire = 60 * 5
+    negative_expire = 30
 
     @classmethod
     def get_key(cls, obj: ChannelInfo):
-        return f'{cls.key}:{obj.id}'
-
-    @classmethod
-    def dump(cls, obj: ChannelInfo):
-        return dumps(obj.model_dump(by_alias=True))
+        return cls.getter(obj.id)
 
     @classmethod
     def expire(cls, obj: ChannelInfo) -> int:
@@ -66,14 +59,11 @@ class ChannelScheme(AbstractScheme[ChannelInfo]):
 class GiveawayParticipantsScheme(AbstractScheme[GiveawayParticipants]):
     model = GiveawayParticipants
     key = "participants"
+    compression = Zlib
 
     @classmethod
     def get_key(cls, obj: GiveawayParticipants):
-        return f'{cls.key}:{obj.id}'
-
-    @classmethod
-    def dump(cls, obj: GiveawayParticipants):
-        return obj.to_json()
+        return cls.getter(obj.id)
 
     @classmethod
     def expire(cls, obj: GiveawayParticipants) -> int:
@@ -81,6 +71,19 @@ class GiveawayParticipantsScheme(AbstractScheme[GiveawayParticipants]):
         return 60 * 10
 
 
+class GiveawayParticipantsSetScheme(AbstractSetScheme[int]):
+    """ User ids of a giveaway participants as a native Redis SET """
+    key = "participants_set"
+
+    @classmethod
+    def expire(cls, owner_id: int | str) -> int:
+        return day_in_seconds
+
+    @classmethod
+    def load_member(cls, raw: bytes) -> int:
+        return int(raw)
+
+
 schemas: dict = {
     ParticipationMessage: ParticipationScheme,
     Giveaway: GiveawayScheme,
@@ -88,4 +91,13 @@ schemas: dict = {
     GiveawayParticipants: GiveawayParticipantsScheme
 }
 
-__all__ = ["schemas"]
+
+def get_scheme(model: type) -> AbstractScheme:
+    """ Return the scheme registered for the model """
+    scheme: AbstractScheme = schemas.get(model)
+    if not scheme:
+        raise NotImplementedError(f"Scheme not found for {model.__name__}")
+    return scheme
+
+
+__all__ = ["schemas", "get_scheme"]
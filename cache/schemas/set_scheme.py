@@ -0,0 +1,29 @@
+from abc import ABC, abstractmethod
+
+
+class AbstractSetScheme[T](ABC):
+    """ Scheme of a native Redis SET, keyed by owner id (e.g. giveaway id) """
+    key: str
+
+    def __init_subclass__(cls, **kwargs):
+        if not cls.key:
+            raise NotImplementedError("key is required")
+
+    @classmethod
+    @abstractmethod
+    def expire(cls, owner_id: int | str) -> int | None:
+        """ Return the expiration time of the whole set in seconds, refreshed on every add """
+        pass
+
+    @classmethod
+    def getter(cls, owner_id: int | str) -> str:
+        return f'{cls.key}:{owner_id}'
+
+    @classmethod
+    def dump_member(cls, member: T) -> bytes | str | int:
+        return member
+
+    @classmethod
+    def load_member(cls, raw: bytes) -> T:
+        return raw
+
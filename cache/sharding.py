@@ -0,0 +1,43 @@
+from bisect import bisect
+from hashlib import blake2b
+
+
+def hash_tag(key: str) -> str:
+    """ Part of the key used for routing, same rule as Redis Cluster: the first non-empty {...} """
+    start = key.find("{")
+    if start != -1:
+        end = key.find("}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest())
+
+
+class HashRing:
+    """ Consistent hashing of keys to node indexes, adding a node moves ~1/N of the keys """
+
+    def __init__(self, nodes: list[str], replicas: int = 160):
+        points = sorted(
+            (_hash(f"{node}#{replica}"), index)
+            for index, node in enumerate(nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [index for _, index in points]
+        self.size = len(nodes)
+
+    def get(self, key: str) -> int:
+        """ Return the index of the node owning the key """
+        if self.size == 1:
+            return 0
+        i = bisect(self._points, _hash(hash_tag(key)))
+        return self._owners[i % len(self._owners)]
+
+
+__all__ = [
+    "HashRing",
+    "hash_tag",
+]
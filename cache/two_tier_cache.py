@@ -0,0 +1,203 @@
+import asyncio
+import json
+from typing import AsyncIterator, Type
+from uuid import uuid4
+
+from loguru import logger
+from pydantic import BaseModel
+from redis.asyncio.client import PubSub
+
+from cache.abstract_cache import AbstractCache, MISSING
+from cache.local_cache import LocalCache
+from cache.metrics import CacheMetrics
+from cache.redis_cache import RedisCache
+from cache.schemas import AbstractScheme, get_scheme
+from cache.single_flight import Loader
+
+
+class TwoTierCache(AbstractCache):
+    """ In-process LRU (L1) in front of RedisCache (L2).
+    Writes are published to a Redis channel, so every node drops its stale L1 entries.
+    L1 keeps deserialized objects: treat returned objects as read-only.
+    """
+    channel: str = "cache:invalidate"
+    _pubsub: PubSub | None = None
+    _listener: asyncio.Task | None = None
+
+    def __init__(self, remote: RedisCache, max_size: int = 10_000):
+        self._remote = remote
+        self._local = LocalCache(max_size)
+        self._node_id = uuid4().hex
+
+    async def connect(self):
+        await self._remote.connect()
+        self._pubsub = self._remote.client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen())
+
+    @property
+    def metrics(self) -> CacheMetrics:
+        """ Shared with the remote cache, L1 is reported as the "l1_get" operation """
+        return self._remote.metrics
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self._local.clear()
+        await self._remote.close()
+
+    async def dispose(self):
+        await self.close()
+
+    def generation(self, scheme: AbstractScheme) -> int:
+        """ L1 keys follow the generations of the remote cache """
+        return self._remote.generation(scheme)
+
+    def _remember(self, scheme: AbstractScheme, key: str, obj: BaseModel) -> None:
+        if obj is None or not scheme.local_expire:
+            return
+        if obj is MISSING:
+            self._local.set(key, obj, min(scheme.local_expire, scheme.negative_expire))
+            return
+        self._local.set(key, obj, min(scheme.local_expire, scheme.expire(obj)))
+
+    async def _listen(self):
+        """ Drops L1 entries written by other nodes """
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    node_id, keys = json.loads(message["data"])
+                    if node_id == self._node_id:
+                        continue
+                    if keys is None:
+                        self._local.clear()
+                    else:
+                        self._local.delete(*keys)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Invalidations may have been lost while disconnected
+                logger.warning(f"Cache invalidation listener failed: {e}")
+                self._local.clear()
+                await asyncio.sleep(1)
+
+    async def _publish(self, keys: list[str] | None) -> None:
+        if keys is None:
+            self._local.clear()
+        else:
+            self._local.delete(*keys)
+        await self._remote.client.publish(self.channel, json.dumps([self._node_id, keys]))
+
+    async def get[T](self, key: str | int, model: Type[BaseModel]) -> T | None:
+        scheme = get_scheme(model)
+        full_key = self._key(scheme, key)
+        obj = self._local.get(full_key)
+        if obj is not None:
+            self.metrics.hit(scheme.key, "l1_get")
+            return obj
+        self.metrics.miss(scheme.key, "l1_get")
+        invalidations = self._local.invalidations
+        obj = await self._remote.get(key, model)
+        # Skip caching if an invalidation arrived while we were waiting for Redis
+        if invalidations == self._local.invalidations:
+            self._remember(scheme, full_key, obj)
+        return obj
+
+    async def get_many[T](self, keys: list[str | int], model: Type[BaseModel]) -> list[T | None]:
+        scheme = get_scheme(model)
+        full_keys = [self._key(scheme, key) for key in keys]
+        result = [self._local.get(full_key) for full_key in full_keys]
+        missing = [i for i, obj in enumerate(result) if obj is None]
+        self.metrics.hit(scheme.key, "l1_get", len(keys) - len(missing))
+        self.metrics.miss(scheme.key, "l1_get", len(missing))
+        if not missing:
+            return result
+        invalidations = self._local.invalidations
+        loaded = await self._remote.get_many([keys[i] for i in missing], model)
+        remember = invalidations == self._local.invalidations
+        for i, obj in zip(missing, loaded):
+            result[i] = obj
+            if remember:
+                self._remember(scheme, full_keys[i], obj)
+        return result
+
+    async def get_or_load[T](self, key: str | int, model: Type[BaseModel], loader: Loader) -> T | None:
+        scheme = get_scheme(model)
+        full_key = self._key(scheme, key)
+        obj = self._local.get(full_key)
+        if obj is not None:
+            self.metrics.hit(scheme.key, "l1_get")
+            return None if obj is MISSING else obj
+        self.metrics.miss(scheme.key, "l1_get")
+        invalidations = self._local.invalidations
+        obj = await self._remote.get_or_load(key, model, loader)
+        if invalidations == self._local.invalidations:
+            self._remember(scheme, full_key, obj)
+        return obj
+
+    async def set(self, obj: BaseModel):
+        scheme = get_scheme(obj.__class__)
+        await self._remote.set(obj)
+        await self._publish([self._key(scheme, obj)])
+
+    async def set_many(self, objs: list[BaseModel]):
+        if not objs:
+            return
+        await self._remote.set_many(objs)
+        await self._publish([self._key(get_scheme(obj.__class__), obj) for obj in objs])
+
+    async def set_missing(self, key: str | int, model: Type[BaseModel]):
+        await self._remote.set_missing(key, model)
+        await self._publish([self._key(get_scheme(model), key)])
+
+    async def exists(self, obj: BaseModel) -> bool:
+        cached = self._local.get(self._key(get_scheme(obj.__class__), obj))
+        if cached is not None:
+            return cached is not MISSING
+        return await self._remote.exists(obj)
+
+    async def delete(self, model: BaseModel):
+        scheme = get_scheme(model.__class__)
+        await self._remote.delete(model)
+        await self._publish([self._key(scheme, model)])
+
+    async def delete_many(self, keys: list[str | int], model: Type[BaseModel]):
+        scheme = get_scheme(model)
+        await self._remote.delete_many(keys, model)
+        await self._publish([self._key(scheme, key) for key in keys])
+
+    async def invalidate_all(self, model: Type[BaseModel]):
+        await self._remote.invalidate_all(model)
+        if not get_scheme(model).versioned:
+            # L1 keys of a versioned scheme change with its generation, others are unknown here
+            await self._publish(None)
+
+    async def clear(self):
+        await self._remote.clear()
+        await self._publish(None)
+
+    async def get_all(self, model: Type[BaseModel]) -> list[BaseModel]:
+        return await self._remote.get_all(model)
+
+    async def get_all_keys(self) -> list[str]:
+        return await self._remote.get_all_keys()
+
+    async def iter_all[T](self, model: Type[BaseModel], batch: int | None = None) -> AsyncIterator[T]:
+        async for obj in self._remote.iter_all(model, batch):
+            yield obj
+
+    async def iter_keys(self, pattern: str | None = None, batch: int | None = None) -> AsyncIterator[str]:
+        async for key in self._remote.iter_keys(pattern, batch):
+            yield key
+
+    async def get_raw(self, key: str) -> dict:
+        return await self._remote.get_raw(key)
+
+
+__all__ = [
+    "TwoTierCache",
+]
@@ -0,0 +1,111 @@
+import asyncio
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import AsyncIterator, Callable, Sequence, Type
+
+from loguru import logger
+from pydantic import BaseModel
+
+from cache.abstract_cache import AbstractCache, Seconds
+
+# Yields pages of objects (or rows, see WarmUpStage.convert) to put into the cache
+PageSource = Callable[[], AsyncIterator[Sequence]]
+
+
+@dataclass(slots=True)
+class WarmUpStage:
+    model: Type[BaseModel]
+    source: PageSource
+    convert: Callable[[object], BaseModel] | None = None
+    loaded: int = 0
+
+
+@dataclass(slots=True)
+class WarmUpReport:
+    loaded: dict[str, int] = field(default_factory=dict)
+    duration: float = 0.0
+    completed: bool = False
+
+
+class CacheWarmUp:
+    """ Fills the cache on startup: each registered source streams pages that are written through set_many.
+    At most `concurrency` pages are written at once. run() stops after `budget` seconds either way,
+    no write is left running after it, and sets `ready` when it returns.
+    """
+
+    def __init__(self, cache: AbstractCache, concurrency: int = 4, budget: Seconds = 60):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.budget = budget
+        self.ready = asyncio.Event()
+        self._stages: list[WarmUpStage] = []
+
+    def register(
+            self,
+            model: Type[BaseModel],
+            source: PageSource,
+            convert: Callable[[object], BaseModel] | None = None,
+    ) -> None:
+        """ convert turns a row of the source (e.g. an SQL model) into a cachable model """
+        self._stages.append(WarmUpStage(model, source, convert))
+
+    @property
+    def progress(self) -> dict[str, int]:
+        return {stage.model.__name__: stage.loaded for stage in self._stages}
+
+    async def run(self) -> WarmUpReport:
+        started = monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        report = WarmUpReport()
+        try:
+            async with asyncio.timeout(self.budget):
+                await asyncio.gather(*(self._run_stage(stage, semaphore) for stage in self._stages))
+            report.completed = True
+        except TimeoutError:
+            logger.warning(f"Cache warm-up ran out of {self.budget}s budget: {self.progress}")
+        finally:
+            report.loaded = self.progress
+            report.duration = monotonic() - started
+            self.ready.set()
+        logger.info(f"Cache warm-up finished in {report.duration:.2f}s: {report.loaded}")
+        return report
+
+    async def _run_stage(self, stage: WarmUpStage, semaphore: asyncio.Semaphore) -> None:
+        writes: set[asyncio.Task] = set()
+        try:
+            try:
+                async for page in stage.source():
+                    objs = [stage.convert(row) for row in page] if stage.convert else list(page)
+                    # Read the next page while this one is being written
+                    await semaphore.acquire()
+                    task = asyncio.create_task(self._write(stage, objs, semaphore))
+                    writes.add(task)
+                    task.add_done_callback(writes.discard)
+            except Exception as e:
+                logger.error(f"Cache warm-up of {stage.model.__name__} failed: {e}")
+            # Pages read before a failure are written too
+            for result in await asyncio.gather(*writes, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.error(f"Cache warm-up of {stage.model.__name__} failed to write a page: {result}")
+        finally:
+            # Out of budget: no write outlives run()
+            pending = [task for task in writes if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+    async def _write(self, stage: WarmUpStage, objs: list[BaseModel], semaphore: asyncio.Semaphore) -> None:
+        try:
+            await self.cache.set_many(objs)
+            stage.loaded += len(objs)
+            logger.debug(f"Cache warm-up {stage.model.__name__}: {stage.loaded} loaded")
+        finally:
+            semaphore.release()
+
+
+__all__ = [
+    "CacheWarmUp",
+    "WarmUpReport",
+    "PageSource",
+]
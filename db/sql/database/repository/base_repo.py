@@ -1,4 +1,4 @@
-from typing import TypeVar, Optional, Sequence, Mapping, Any
+from typing import TypeVar, Optional, Sequence, Mapping, Any, AsyncIterator
 
 from sqlalchemy import Select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -66,6 +66,31 @@ class BaseRepo(Generic[model]):
             query = query.filter_by(**filters)
         return (await session.execute(query)).scalars().all()
 
+    @classmethod
+    async def iter_pages(
+            cls,
+            session: AsyncSession,
+            filters: Mapping[str, Any] = None,
+            page_size: int = 1000,
+            pr_key: str = "id",
+    ) -> AsyncIterator[Sequence['model']]:
+        """ Use to stream all existing with filters page by page (keyset pagination by pr_key) """
+        column = getattr(cls.model, pr_key)
+        last = None
+        while True:
+            query: Select = Select(cls.model).order_by(column).limit(page_size)
+            if filters:
+                query = query.filter_by(**filters)
+            if last is not None:
+                query = query.where(column > last)
+            page = (await session.execute(query)).scalars().all()
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            last = getattr(page[-1], pr_key)
+
     @classmethod
     async def get(cls, arg, value, session: AsyncSession) -> Optional['model']:
         """ Use to get one existing (get()) """
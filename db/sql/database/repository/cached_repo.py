@@ -0,0 +1,105 @@
+import asyncio
+from typing import Any, Sequence
+
+from loguru import logger
+from pydantic import BaseModel
+from sqlalchemy import Select, event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import AbstractCache, MISSING
+from db.sql.database.repository.base_repo import BaseRepo, model
+
+_PENDING = "cache_invalidations"
+
+
+class CachedRepo(BaseRepo[model]):
+    """ BaseRepo with cache-aside reads by primary key.
+    get_cached/get_many_cached return cache models (cache_model must have a scheme in cache.schemas),
+    update/patch/delete drop the cached entry after the commit, a rollback keeps it: update commits by itself,
+    after delete commit with CachedRepo.commit(session), the entry is dropped before it returns.
+    Set `cache` before use, e.g. CachedRepo.cache = dp.cache
+    """
+
+    cache: AbstractCache
+    cache_model: type[BaseModel]
+    pr_key: str = "id"
+
+    @classmethod
+    def to_cache(cls, obj: 'model') -> BaseModel:
+        """ Converts SQL model into the cache model, override if fields differ """
+        return cls.cache_model.model_validate(obj.to_dict())
+
+    @classmethod
+    async def get_cached(cls, ID: int | str, session: AsyncSession) -> BaseModel | None:
+        """ Use to get one existing by primary key, from the cache if possible """
+
+        async def loader():
+            obj = await cls.get(cls.pr_key, ID, session)
+            return cls.to_cache(obj) if obj else None
+
+        return await cls.cache.get_or_load(ID, cls.cache_model, loader)
+
+    @classmethod
+    async def get_many_cached(cls, IDs: Sequence[int | str], session: AsyncSession) -> list[BaseModel | None]:
+        """ Use to get many existing by primary keys: one cache round trip, one SQL query for the misses """
+        found = await cls.cache.get_many(list(IDs), cls.cache_model)
+        missing = [ID for ID, obj in zip(IDs, found) if obj is None]
+        if missing:
+            query: Select = Select(cls.model).where(getattr(cls.model, cls.pr_key).in_(missing))
+            rows = (await session.execute(query)).scalars().all()
+            loaded = {getattr(row, cls.pr_key): cls.to_cache(row) for row in rows}
+            await cls.cache.set_many(list(loaded.values()))
+            found = [loaded.get(ID) if obj is None else obj for ID, obj in zip(IDs, found)]
+        return [None if obj is MISSING else obj for obj in found]
+
+    @classmethod
+    async def commit(cls, session: AsyncSession) -> None:
+        """ Use instead of session.commit() after delete: commits, then drops the deleted entries """
+        await session.commit()
+        await cls._invalidate_pending(session)
+
+    @classmethod
+    async def update(cls, ID: int | str, data: dict, session: AsyncSession, pr_key: str = "id") -> 'model':
+        """ BaseRepo.update commits by itself, so the entry is dropped right after it """
+        obj = await super().update(ID, data, session=session, pr_key=pr_key)
+        cls._invalidate_on_commit(session, getattr(obj, cls.pr_key))
+        # Deletes pending in the session were committed too
+        await cls._invalidate_pending(session)
+        return obj
+
+    @classmethod
+    async def delete(cls, ID: int, session: AsyncSession) -> None:
+        """ The entry is dropped by CachedRepo.commit(session) """
+        await super().delete(ID, session=session)
+        cls._invalidate_on_commit(session, ID)
+
+    @classmethod
+    def _invalidate_on_commit(cls, session: AsyncSession, ID: int | str) -> None:
+        pending: dict[type[CachedRepo], set] | None = session.info.get(_PENDING)
+        if pending is None:
+            pending = session.info[_PENDING] = {}
+            event.listen(session.sync_session, "after_rollback", CachedRepo._after_rollback)
+        pending.setdefault(cls, set()).add(ID)
+
+    @staticmethod
+    async def _invalidate_pending(session: AsyncSession) -> None:
+        pending: dict[type[CachedRepo], set] = session.info.get(_PENDING, {})
+        invalidations = [repo._invalidate(IDs) for repo, IDs in pending.items()]
+        pending.clear()
+        await asyncio.gather(*invalidations)
+
+    @classmethod
+    async def _invalidate(cls, IDs: set[Any]) -> None:
+        try:
+            await cls.cache.delete_many(list(IDs), cls.cache_model)
+        except Exception as e:
+            logger.error(f"Failed to invalidate {cls.cache_model.__name__} {IDs}: {e}")
+
+    @staticmethod
+    def _after_rollback(session) -> None:
+        session.info.get(_PENDING, {}).clear()
+
+
+__all__ = [
+    "CachedRepo",
+]
@@ -1 +1 @@
-from .rabbitmq import RabbitMQConfig, Consumer, Producer
\ No newline at end of file
+from .rabbitmq import RabbitMQConfig, Consumer, Producer, RabbitMQConnection
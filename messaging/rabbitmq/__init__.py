@@ -1,3 +1,14 @@
 from .consumer import RabbitMQConfig
 from .consumer import Consumer
-from .producer import Producer
\ No newline at end of file
+from .batch_consumer import BatchConsumer
+from .producer import Producer
+from .stats import ConsumerStats
+from .retry import RetryPolicy
+from .acks import AckBatcher
+from .connection import RabbitMQConnection
+from .codecs import MessageCodec, PydanticJsonCodec, MsgpackCodec, BytesCodec, Deflate, Lz4
+from .process_consumer import ProcessConsumer
+from .flow import FlowControl
+from .rpc import RpcServer, RpcClient, RpcError
+from .dedup import Deduplicator, BloomFilter
+from .memory_broker import MemoryBroker, InMemoryConnection
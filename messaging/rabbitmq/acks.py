@@ -0,0 +1,111 @@
+import asyncio
+from collections import deque
+
+from aio_pika.abc import AbstractIncomingMessage
+from loguru import logger
+
+
+class AckBatcher:
+    """ Coalesces acks of one channel: once `batch_size` messages are done (or every `interval` seconds, see run)
+    a single ack with multiple=True confirms everything up to the highest delivery tag below which
+    every message is done. Messages done behind an unfinished one are acked one by one in the same flush,
+    so a slow message holds back no acks for longer than a flush. Messages must be tracked in delivery order.
+    Acks and nacks of messages tracked before reset() are ignored: their tags belong to the old channel,
+    the broker redelivers those messages.
+    """
+
+    def __init__(self, batch_size: int = 50, interval: float = 0.1):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending: deque[AbstractIncomingMessage] = deque()
+        # id() of the pending messages: unique while they are alive, i.e. tracked
+        self._tracked: set[int] = set()
+        self._done: set[int] = set()
+        # Settled on their own (nack), a multiple ack must not be sent with their tag
+        self._settled: set[int] = set()
+        self._watermark: AbstractIncomingMessage | None = None
+        # Done behind an unfinished message, by tag
+        self._blocked: dict[int, AbstractIncomingMessage] = {}
+        self._unacked = 0
+        # Acks must reach the broker in the order of their tags
+        self._lock = asyncio.Lock()
+
+    def track(self, message: AbstractIncomingMessage) -> None:
+        self._pending.append(message)
+        self._tracked.add(id(message))
+
+    def _is_stale(self, message: AbstractIncomingMessage) -> bool:
+        if id(message) in self._tracked:
+            return False
+        logger.debug("Ignoring settlement of message {} from before the channel was reopened", message.delivery_tag)
+        return True
+
+    async def ack(self, message: AbstractIncomingMessage) -> None:
+        if self._is_stale(message):
+            return
+        self._done.add(message.delivery_tag)
+        self._advance()
+        if message.delivery_tag in self._done:
+            self._blocked[message.delivery_tag] = message
+        if self._unacked + len(self._blocked) >= self.batch_size:
+            await self.flush()
+
+    async def nack(self, message: AbstractIncomingMessage, requeue: bool = True) -> None:
+        if self._is_stale(message):
+            return
+        await message.nack(requeue=requeue)
+        self._settled.add(message.delivery_tag)
+        self._done.add(message.delivery_tag)
+        self._advance()
+
+    def _advance(self) -> None:
+        while self._pending and self._pending[0].delivery_tag in self._done:
+            message = self._pending.popleft()
+            self._tracked.discard(id(message))
+            self._done.discard(message.delivery_tag)
+            self._blocked.pop(message.delivery_tag, None)
+            if message.delivery_tag in self._settled:
+                self._settled.discard(message.delivery_tag)
+            else:
+                self._watermark = message
+                self._unacked += 1
+
+    async def flush(self) -> None:
+        async with self._lock:
+            message, count = self._watermark, self._unacked
+            self._watermark, self._unacked = None, 0
+            blocked, self._blocked = list(self._blocked.values()), {}
+            # Acked on their own, the multiple ack of a later flush must skip them
+            self._settled.update(single.delivery_tag for single in blocked)
+            try:
+                if message is not None:
+                    await message.ack(multiple=True)
+                for single in blocked:
+                    await single.ack()
+            except Exception as e:
+                # The channel is gone, the broker redelivers these messages
+                logger.warning(f"Failed to ack {count + len(blocked)} messages: {e}")
+
+    async def run(self) -> None:
+        """ Flushes every `interval` seconds, so acks are not held back by a slow batch """
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def reset(self) -> None:
+        """ Forget tracked messages, e.g. after the channel was reopened and delivery tags restarted """
+        self._pending.clear()
+        self._tracked.clear()
+        self._done.clear()
+        self._settled.clear()
+        self._blocked.clear()
+        self._watermark, self._unacked = None, 0
+
+    def __len__(self) -> int:
+        """ Tracked messages not acked yet """
+        return len(self._pending) + self._unacked
+
+
+__all__ = [
+    "AckBatcher",
+]
@@ -0,0 +1,150 @@
+import asyncio
+from time import perf_counter
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+from aio_pika.abc import AbstractIncomingMessage
+from loguru import logger
+
+from messaging.rabbitmq.connection import RabbitMQConnection
+from messaging.rabbitmq.consumer import Consumer, RabbitMQConfig
+from messaging.rabbitmq.retry import RetryPolicy
+from settings.project_settings import RabbitMQSettings
+
+if TYPE_CHECKING:
+    from messaging.rabbitmq.dedup import Deduplicator
+
+# Takes decoded messages, returns positions of the ones that failed (None - all succeeded)
+BatchHandler = Callable[[list], Awaitable[list[int] | None]]
+
+
+class BatchConsumer[T](Consumer[T]):
+    """ Delivers messages to the handler in lists of up to `max_batch`, a smaller batch is sent
+    after `max_wait_ms`. Succeeded messages are acked together, the failed ones (the positions returned
+    by the handler, or all of them if it raises) are retried like in Consumer.
+    Up to `concurrency` batches are handled at once, stats count batches as in-flight items.
+    With dedup, duplicates are acked before they get into a batch.
+    """
+
+    def __init__(self,
+                 app_config: [RabbitMQSettings],
+                 rabbit_config: RabbitMQConfig,
+                 message_handler: BatchHandler,
+                 deserializer: Callable[[str], T] | None = None,
+                 max_batch: int = 100,
+                 max_wait_ms: int = 50,
+                 concurrency: int = 1,
+                 prefetch_count: int | None = None,
+                 retry_policy: RetryPolicy | None = None,
+                 ack_interval: float = 0.1,
+                 connection: RabbitMQConnection | None = None,
+                 model: type[T] | None = None,
+                 dedup: 'Deduplicator | None' = None):
+        super().__init__(
+            app_config,
+            rabbit_config,
+            message_handler,
+            deserializer,
+            concurrency=concurrency,
+            # A batch can't fill up if the broker stops delivering before
+            prefetch_count=prefetch_count or max_batch * concurrency,
+            retry_policy=retry_policy,
+            ack_batch_size=max_batch,
+            ack_interval=ack_interval,
+            connection=connection,
+            model=model,
+            dedup=dedup,
+        )
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._batch: list[tuple[AbstractIncomingMessage, T, str | None]] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    async def _dispatch(self, message: AbstractIncomingMessage):
+        key = self._dedup_key(message)
+        if key is not None and not await self.dedup.claim(key, message.redelivered):
+            logger.debug("Duplicate message {} in {}", key, self.rabbit_config.queue)
+            await self._acks.ack(message)
+            return
+        try:
+            decoded_message = self._translate(message)
+        except Exception as e:
+            logger.error(f"Failed to decode message in {self.rabbit_config.queue} {e}")
+            self._release(key)
+            await self._dead_letter(message, e)
+            return
+        # The dedup key travels with the message, a body hash is computed once
+        self._batch.append((message, decoded_message, key))
+        if len(self._batch) >= self.max_batch:
+            await self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush_later)
+
+    async def _drain(self, deadline: float):
+        await self._flush()
+        await super()._drain(deadline)
+
+    def _flush_later(self) -> None:
+        self._timer = None
+        task = asyncio.create_task(self._flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self) -> None:
+        """ Waits for a free slot and handles the collected batch in background """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        await self._slots.acquire()
+        if self._drained:
+            self._slots.release()
+            self._release_batch(batch)
+            return
+        task = asyncio.create_task(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list[tuple[AbstractIncomingMessage, T, str | None]]):
+        try:
+            self.stats.started()
+            started = perf_counter()
+            failed = await self._process_batch(batch)
+            self.stats.finished_batch(perf_counter() - started, len(batch) - failed, failed)
+        finally:
+            self._slots.release()
+            self._release_batch(batch)
+
+    def _release(self, key: str | None) -> None:
+        if key is not None:
+            self.dedup.release(key)
+
+    def _release_batch(self, batch: list[tuple[AbstractIncomingMessage, T, str | None]]) -> None:
+        for _, _, key in batch:
+            self._release(key)
+
+    async def _process_batch(self, batch: list[tuple[AbstractIncomingMessage, T, str | None]]) -> int:
+        """ Return the number of failed messages """
+        try:
+            failed = set(await self.message_handler([decoded for _, decoded, _ in batch]) or ())
+            error = None
+        except Exception as e:
+            logger.error(f"Error processing batch of {len(batch)} in {self.rabbit_config.queue} {e}")
+            failed, error = set(range(len(batch))), e
+        # Recorded together: one round trip
+        await asyncio.gather(*(
+            self.dedup.record(key) for i, (_, _, key) in enumerate(batch) if i not in failed and key is not None
+        ))
+        for i, (message, _, _) in enumerate(batch):
+            if i in failed:
+                await self._retry(message, error or RuntimeError("Rejected by the batch handler"))
+            else:
+                await self._acks.ack(message)
+        return len(failed)
+
+
+__all__ = [
+    "BatchConsumer",
+    "BatchHandler",
+]
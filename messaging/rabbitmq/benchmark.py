@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from itertools import product
+from time import perf_counter
+from typing import Type
+from uuid import uuid4
+
+from loguru import logger
+
+from messaging.rabbitmq.batch_consumer import BatchConsumer
+from messaging.rabbitmq.codecs import MessageCodec, MessageCompression, PydanticJsonCodec, MsgpackCodec, Lz4, Deflate
+from messaging.rabbitmq.connection import RabbitMQConnection
+from messaging.rabbitmq.consumer import Consumer, RabbitMQConfig
+from messaging.rabbitmq.memory_broker import InMemoryConnection
+from messaging.rabbitmq.producer import Producer
+from messaging.rabbitmq.retry import dead_letter_names
+
+# "text" is the serializer/deserializer path of producers and consumers without a codec
+CODECS: dict[str, Type[MessageCodec] | None] = {
+    "text": None,
+    "json": PydanticJsonCodec,
+    "msgpack": MsgpackCodec,
+}
+COMPRESSIONS: dict[str, Type[MessageCompression] | None] = {
+    "none": None,
+    "deflate": Deflate,
+    "lz4": Lz4,
+}
+
+
+@dataclass(slots=True)
+class Scenario:
+    prefetch: int
+    concurrency: int
+    batch: int = 0  # BatchConsumer with max_batch=batch, Consumer if 0
+    codec: str = "json"
+    compression: str = "none"
+    messages: int = 10000
+    payload_size: int = 256
+
+    @property
+    def name(self) -> str:
+        return (
+            f"prefetch={self.prefetch} concurrency={self.concurrency} batch={self.batch} "
+            f"codec={self.codec} compression={self.compression}"
+        )
+
+
+@dataclass(slots=True)
+class Result:
+    scenario: Scenario
+    send_rate: float  # messages/s confirmed by send_many
+    rate: float  # messages/s from the first send to the last handled message
+    p50: float  # publish to handler latency, ms
+    p90: float
+    p99: float
+    peak_kib: float | None = None  # traced memory peak over the run
+    bytes_per_message: float | None = None  # memory still allocated after the run
+
+    def row(self) -> str:
+        memory = "-" if self.peak_kib is None else f"{self.peak_kib:10.0f} {self.bytes_per_message:9.1f}"
+        return (
+            f"{self.send_rate:10.0f} {self.rate:10.0f} {self.p50:8.2f} {self.p90:8.2f} {self.p99:8.2f} "
+            f"{memory}  {self.scenario.name}"
+        )
+
+
+HEADER = f"{'send/s':>10} {'msg/s':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'peak KiB':>10} {'B/msg':>9}"
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+async def run_scenario(connection: RabbitMQConnection, scenario: Scenario, trace_memory: bool = False) -> Result:
+    """ Sends scenario.messages through a fresh queue and consumes them, the connection is shared
+    by the producer and the consumer and stays open
+    """
+    queue = f"benchmark.{uuid4().hex[:8]}"
+    config = RabbitMQConfig(queue=queue, exchange="benchmark", routing_key=queue)
+    codec = CODECS[scenario.codec]
+    latencies: list[float] = []
+    done = asyncio.Event()
+
+    def record(data: dict) -> None:
+        latencies.append(perf_counter() - data["sent"])
+        if len(latencies) >= scenario.messages:
+            done.set()
+
+    async def handle(data: dict) -> None:
+        record(data)
+
+    async def handle_batch(items: list[dict]) -> None:
+        for data in items:
+            record(data)
+
+    producer = Producer[dict](
+        connection.app_config,
+        config,
+        serializer=json.dumps if codec is None else None,
+        connection=connection,
+        codec=codec,
+        compression=COMPRESSIONS[scenario.compression],
+        compress_min_size=0,
+    )
+    common = dict(
+        deserializer=json.loads if codec is None else None,
+        concurrency=scenario.concurrency,
+        prefetch_count=scenario.prefetch,
+        connection=connection,
+    )
+    if scenario.batch:
+        consumer = BatchConsumer[dict](
+            connection.app_config, config, handle_batch, max_batch=scenario.batch, **common
+        )
+    else:
+        consumer = Consumer[dict](connection.app_config, config, handle, **common)
+
+    await producer.connect()
+    consuming = asyncio.create_task(consumer.connect())
+    # The queue is declared by the consumer
+    while consumer._iterator is None and not consuming.done():
+        await asyncio.sleep(0.01)
+
+    payload = "x" * scenario.payload_size
+    if trace_memory:
+        tracemalloc.start()
+    started = perf_counter()
+    await producer.send_many({"sent": perf_counter(), "payload": payload} for _ in range(scenario.messages))
+    sent = perf_counter()
+    await done.wait()
+    finished = perf_counter()
+    peak_kib = bytes_per_message = None
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_kib = peak / 1024
+        bytes_per_message = current / scenario.messages
+
+    await consumer.stop()
+    await consuming
+    await producer.stop()
+    await _delete_queues(connection, config)
+
+    latencies.sort()
+    return Result(
+        scenario=scenario,
+        send_rate=scenario.messages / (sent - started),
+        rate=scenario.messages / (finished - started),
+        p50=percentile(latencies, 0.5) * 1000,
+        p90=percentile(latencies, 0.9) * 1000,
+        p99=percentile(latencies, 0.99) * 1000,
+        peak_kib=peak_kib,
+        bytes_per_message=bytes_per_message,
+    )
+
+
+async def _delete_queues(connection: RabbitMQConnection, config: RabbitMQConfig) -> None:
+    channel = await connection.channel()
+    try:
+        for name in (config.queue, dead_letter_names(config.queue, config.exchange)[1]):
+            queue = await channel.get_queue(name, ensure=False)
+            await queue.delete(if_unused=False, if_empty=False)
+    finally:
+        await channel.close()
+
+
+async def run(connection: RabbitMQConnection, scenarios: list[Scenario], trace_memory: bool = True) -> list[Result]:
+    """ Every scenario is run twice with memory tracing: tracemalloc slows everything down,
+    rates and latencies come from a run without it
+    """
+    results = []
+    print(HEADER)
+    try:
+        for scenario in scenarios:
+            result = await run_scenario(connection, scenario)
+            if trace_memory:
+                traced = await run_scenario(connection, scenario, trace_memory=True)
+                result.peak_kib, result.bytes_per_message = traced.peak_kib, traced.bytes_per_message
+            print(result.row())
+            results.append(result)
+    finally:
+        await connection.close()
+    return results
+
+
+def _ints(value: str) -> list[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def _names(choices: dict):
+    def parse(value: str) -> list[str]:
+        names = value.split(",")
+        for name in names:
+            if name not in choices:
+                raise argparse.ArgumentTypeError(f"{name} is not one of {', '.join(choices)}")
+        return names
+    return parse
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Producer/Consumer throughput, every combination of the comma separated values is run",
+    )
+    parser.add_argument("--broker", choices=("memory", "rabbitmq"), default="memory",
+                        help="the in-process stand-in, or RabbitMQ from project settings")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--payload-size", type=int, default=256)
+    parser.add_argument("--prefetch", type=_ints, default=[10, 100])
+    parser.add_argument("--concurrency", type=_ints, default=[1, 10])
+    parser.add_argument("--batch", type=_ints, default=[0], help="BatchConsumer max_batch, 0 - Consumer")
+    parser.add_argument("--codec", type=_names(CODECS), default=["json"])
+    parser.add_argument("--compression", type=_names(COMPRESSIONS), default=["none"])
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    args = parser.parse_args(argv)
+
+    # Per-message debug logging would be measured too
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    if args.broker == "memory":
+        connection = InMemoryConnection()
+    else:
+        from settings import project_settings
+        connection = RabbitMQConnection(project_settings)
+
+    scenarios = [
+        Scenario(prefetch, concurrency, batch, codec, compression, args.messages, args.payload_size)
+        for prefetch, concurrency, batch, codec, compression in product(
+            args.prefetch, args.concurrency, args.batch, args.codec, args.compression
+        )
+    ]
+    asyncio.run(run(connection, scenarios, trace_memory=not args.no_memory))
+
+
+__all__ = [
+    "Scenario",
+    "Result",
+    "run_scenario",
+    "run",
+    "main",
+]
+
+
+if __name__ == "__main__":
+    main()
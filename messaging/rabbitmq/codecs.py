@@ -0,0 +1,176 @@
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Type
+
+import pydantic_core
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+
+class MessageCodec(ABC):
+    """ Turns message payloads into bytes and back, identified by the content_type property """
+    content_type: str
+    # The encoded body is text, a consumer's deserializer can parse it
+    text: bool = False
+
+    @classmethod
+    @abstractmethod
+    def encode(cls, data: Any) -> bytes:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def decode(cls, body: bytes, model: Type | None = None) -> Any:
+        """ Return an instance of model, or plain python data if model is None """
+        pass
+
+
+class PydanticJsonCodec(MessageCodec):
+    """ JSON straight from/to bytes by pydantic-core """
+    content_type = "application/json"
+    text = True
+
+    @classmethod
+    def encode(cls, data: Any) -> bytes:
+        return pydantic_core.to_json(data, by_alias=True)
+
+    @classmethod
+    def decode(cls, body: bytes, model: Type | None = None) -> Any:
+        if model is not None and issubclass(model, BaseModel):
+            return model.model_validate_json(body)
+        data = pydantic_core.from_json(body)
+        return data if model is None else model(**data)
+
+
+class MsgpackCodec(MessageCodec):
+    """ Requires msgpack """
+    content_type = "application/msgpack"
+
+    @classmethod
+    def encode(cls, data: Any) -> bytes:
+        if isinstance(data, BaseModel):
+            data = data.model_dump(mode="json", by_alias=True)
+        return msgpack.packb(data)
+
+    @classmethod
+    def decode(cls, body: bytes, model: Type | None = None) -> Any:
+        data = msgpack.unpackb(body)
+        if model is None:
+            return data
+        if issubclass(model, BaseModel):
+            return model.model_validate(data)
+        return model(**data)
+
+
+class BytesCodec(MessageCodec):
+    """ Payloads that are bytes already, passed through as is """
+    content_type = "application/octet-stream"
+
+    @classmethod
+    def encode(cls, data: bytes | bytearray | memoryview) -> bytes:
+        return data if isinstance(data, bytes) else bytes(data)
+
+    @classmethod
+    def decode(cls, body: bytes, model: Type | None = None) -> bytes:
+        return body
+
+
+class MessageCompression(ABC):
+    """ Identified by the content_encoding property """
+    content_encoding: str
+
+    @classmethod
+    @abstractmethod
+    def compress(cls, data: bytes) -> bytes:
+        pass
+
+    @classmethod
+    @abstractmethod
+    def decompress(cls, data: bytes) -> bytes:
+        pass
+
+
+class Deflate(MessageCompression):
+    content_encoding = "deflate"
+    level: int = 1
+
+    @classmethod
+    def compress(cls, data: bytes) -> bytes:
+        return zlib.compress(data, cls.level)
+
+    @classmethod
+    def decompress(cls, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class Lz4(MessageCompression):
+    """ Requires lz4 """
+    content_encoding = "lz4"
+
+    @classmethod
+    def compress(cls, data: bytes) -> bytes:
+        return lz4.compress(data)
+
+    @classmethod
+    def decompress(cls, data: bytes) -> bytes:
+        return lz4.decompress(data)
+
+
+codecs: dict[str, Type[MessageCodec]] = {
+    codec.content_type: codec for codec in (PydanticJsonCodec, MsgpackCodec, BytesCodec)
+}
+compressions: dict[str, Type[MessageCompression]] = {
+    compression.content_encoding: compression for compression in (Deflate, Lz4)
+}
+
+
+def encode_body(
+        data: Any,
+        codec: Type[MessageCodec],
+        compression: Type[MessageCompression] | None = None,
+        compress_min_size: int = 1024,
+) -> tuple[bytes, str, str | None]:
+    """ Return (body, content_type, content_encoding), bytes-like data is sent as is whatever the codec """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        codec = BytesCodec
+    body = codec.encode(data)
+    if compression and len(body) >= compress_min_size:
+        return compression.compress(body), codec.content_type, compression.content_encoding
+    return body, codec.content_type, None
+
+
+def decompress_body(body: bytes, content_encoding: str | None) -> bytes:
+    """ Raises KeyError for an unknown encoding """
+    if content_encoding:
+        return compressions[content_encoding].decompress(body)
+    return body
+
+
+def decode_body(body: bytes, content_type: str | None, content_encoding: str | None, model: Type | None = None) -> Any:
+    """ Raises KeyError for an unknown content type or encoding """
+    return codecs[content_type].decode(decompress_body(body, content_encoding), model)
+
+
+__all__ = [
+    "MessageCodec",
+    "PydanticJsonCodec",
+    "MsgpackCodec",
+    "BytesCodec",
+    "MessageCompression",
+    "Deflate",
+    "Lz4",
+    "codecs",
+    "compressions",
+    "encode_body",
+    "decompress_body",
+    "decode_body",
+]
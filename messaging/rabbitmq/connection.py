@@ -0,0 +1,117 @@
+import asyncio
+from itertools import count
+
+from aio_pika import connect_robust, ExchangeType
+from aio_pika.abc import AbstractRobustConnection, AbstractChannel, AbstractExchange, AbstractQueue
+from loguru import logger
+
+from settings.project_settings import RabbitMQSettings
+
+
+class RabbitMQConnection:
+    """ Robust connections shared by producers and consumers of a process.
+    Every user gets its own channel, connections of the pool are handed out in turn.
+    Exchanges, queues and bindings are declared once, later users get them without a round trip.
+    """
+
+    def __init__(self, app_config: [RabbitMQSettings], pool_size: int = 1, timeout: float = 5):
+        self.app_config = app_config
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connections: list[AbstractRobustConnection] = []
+        self._turn = count()
+        self._lock = asyncio.Lock()
+        self._exchanges: set[str] = set()
+        self._queues: set[str] = set()
+        self._bindings: set[tuple[str, str, str]] = set()
+
+    @property
+    def connection(self) -> AbstractRobustConnection | None:
+        return self.connections[0] if self.connections else None
+
+    @property
+    def is_connected(self) -> bool:
+        return bool(self.connections) and all(not connection.is_closed for connection in self.connections)
+
+    async def connect(self, max_retries: int = 5, retry_delay: float = 2.0) -> None:
+        """ Connect to RabbitMQ with retries, does nothing if already connected. """
+        async with self._lock:
+            if self.connections:
+                return
+            tries = 0
+            while tries <= max_retries:
+                tries += 1
+                try:
+                    for _ in range(self.pool_size - len(self.connections)):
+                        self.connections.append(await self._connect())
+                    break
+                except Exception as e:
+                    logger.warning(f"Connection attempt {tries}/{max_retries} failed: {e}")
+                    if tries < max_retries:
+                        await asyncio.sleep(retry_delay)
+                    else:
+                        logger.error("Max retries reached. Failed to connect to RabbitMQ.")
+                        await self.close()
+                        raise
+            logger.info(f"RabbitMQ connected, {len(self.connections)} connection(s).")
+
+    async def _connect(self) -> AbstractRobustConnection:
+        try:
+            return await asyncio.wait_for(connect_robust(
+                url=self.app_config.rabbitmq_url,  # type: ignore
+                login=self.app_config.RABBITMQ_USER,  # type: ignore
+                password=self.app_config.RABBITMQ_PASSWORD  # type: ignore
+            ), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Failed to connect to RabbitMQ, timeout")
+
+    async def channel(self, publisher_confirms: bool = True) -> AbstractChannel:
+        if not self.connections:
+            await self.connect()
+        connection = self.connections[next(self._turn) % len(self.connections)]
+        return await connection.channel(publisher_confirms=publisher_confirms)
+
+    async def exchange(
+            self,
+            channel: AbstractChannel,
+            name: str,
+            type: ExchangeType = ExchangeType.DIRECT,
+            **kwargs,
+    ) -> AbstractExchange:
+        """ Declared on the first call, the arguments must not differ between calls """
+        if name in self._exchanges:
+            return await channel.get_exchange(name, ensure=False)
+        exchange = await channel.declare_exchange(name, type, **kwargs)
+        self._exchanges.add(name)
+        return exchange
+
+    async def queue(self, channel: AbstractChannel, name: str, **kwargs) -> AbstractQueue:
+        """ Declared on the first call, the arguments must not differ between calls """
+        if name in self._queues:
+            return await channel.get_queue(name, ensure=False)
+        queue = await channel.declare_queue(name, **kwargs)
+        self._queues.add(name)
+        return queue
+
+    async def bind(self, queue: AbstractQueue, exchange: AbstractExchange, routing_key: str) -> None:
+        binding = (queue.name, exchange.name, routing_key)
+        if binding in self._bindings:
+            return
+        await queue.bind(exchange, routing_key=routing_key)
+        self._bindings.add(binding)
+
+    async def close(self) -> None:
+        for connection in self.connections:
+            try:
+                await connection.close()
+            except Exception as e:
+                logger.warning(f"Failed to close RabbitMQ connection: {e}")
+        self.connections = []
+        self._exchanges.clear()
+        self._queues.clear()
+        self._bindings.clear()
+
+
+__all__ = [
+    "RabbitMQConnection",
+]
@@ -1,13 +1,27 @@
 import asyncio
 from dataclasses import dataclass
-from typing import Callable, Any
+from time import perf_counter
+from typing import Callable, Any, Hashable, TYPE_CHECKING
 
-from aio_pika import connect_robust, ExchangeType
-from aio_pika.abc import AbstractIncomingMessage, AbstractRobustConnection
+from aio_pika import ExchangeType
+from aio_pika.abc import (
+    AbstractIncomingMessage, AbstractRobustConnection, AbstractChannel, AbstractExchange, AbstractQueueIterator,
+)
 from loguru import logger
 
+from messaging.rabbitmq.acks import AckBatcher
+from messaging.rabbitmq.codecs import codecs, decode_body, decompress_body
+from messaging.rabbitmq.connection import RabbitMQConnection
+from messaging.rabbitmq.flow import FlowControl
+from messaging.rabbitmq.retry import (
+    RetryPolicy, ATTEMPT_HEADER, ERROR_HEADER, retry_queue_name, dead_letter_names, attempt_of, copy_message,
+)
+from messaging.rabbitmq.stats import ConsumerStats
 from settings.project_settings import RabbitMQSettings
 
+if TYPE_CHECKING:
+    from messaging.rabbitmq.dedup import Deduplicator
+
 
 @dataclass(slots=True)
 class RabbitMQConfig:
@@ -16,81 +30,332 @@ class RabbitMQConfig:
     routing_key: str
 
 
+def translate[T](
+        body: bytes,
+        content_type: str | None,
+        content_encoding: str | None,
+        deserializer: Callable[[str], T] | None = None,
+        model: type[T] | None = None,
+) -> T:
+    """ Decode a message body: into model by its codec if content_type is known, as text through deserializer
+    otherwise. Without a model the deserializer still gets tagged messages: the text of text codecs (JSON),
+    the decoded payload of binary ones
+    """
+    if content_type in codecs:
+        if deserializer is None or model is not None:
+            return decode_body(body, content_type, content_encoding, model)
+        if codecs[content_type].text:
+            return deserializer(decompress_body(body, content_encoding).decode())
+        return deserializer(decode_body(body, content_type, content_encoding))
+    # Text sent by producers without a codec
+    text = body.decode()
+    return deserializer(text) if deserializer else text
+
+
 class Consumer[T]:
+    """ Runs up to `concurrency` handlers at once, the broker delivers up to `prefetch_count` unacked messages
+    (defaults to concurrency). With ordering_key, messages with the same key are handled one after another
+    in delivery order, e.g. ordering_key=lambda message: message.headers.get("user_id")
+    A message is acked after the handler succeeds, acks are coalesced (see AckBatcher).
+    A failed message is retried with backoff according to retry_policy, then dead-lettered;
+    one that can't be deserialized is dead-lettered right away.
+    Messages with a known content_type (see codecs) are decoded into `model`, text messages without one
+    go through `deserializer`; without a model, tagged messages go through the deserializer too
+    (plain data if there is none), see translate.
+    With flow, prefetch_count is adjusted at runtime (see FlowControl), concurrency stays the upper bound.
+    With dedup, a message whose key was handled already is acked without calling the handler (see Deduplicator),
+    the key is recorded after the handler succeeds.
+    """
     connection: AbstractRobustConnection | None
+    channel: AbstractChannel | None = None
+    _dlx: AbstractExchange
+    _iterator: AbstractQueueIterator | None = None
+    _background: tuple[asyncio.Task, ...] = ()
 
     def __init__(self,
                  app_config: [RabbitMQSettings],
                  rabbit_config: RabbitMQConfig,
                  message_handler: Callable[[T], Any],
-                 deserializer: Callable[[str], T]):
+                 deserializer: Callable[[str], T] | None = None,
+                 concurrency: int = 1,
+                 prefetch_count: int | None = None,
+                 ordering_key: Callable[[AbstractIncomingMessage], Hashable | None] | None = None,
+                 retry_policy: RetryPolicy | None = None,
+                 ack_batch_size: int = 50,
+                 ack_interval: float = 0.1,
+                 connection: RabbitMQConnection | None = None,
+                 model: type[T] | None = None,
+                 flow: FlowControl | None = None,
+                 dedup: 'Deduplicator | None' = None):
         self.app_config = app_config
         self.rabbit_config = rabbit_config
         self.message_handler = message_handler
         self.deserializer = deserializer
+        self.model = model
+        self.concurrency = concurrency
+        self.prefetch_count = prefetch_count or concurrency
+        self.flow = flow
+        if flow:
+            self.prefetch_count = min(max(self.prefetch_count, flow.min_prefetch), flow.max_prefetch)
+        self.ordering_key = ordering_key
+        self.dedup = dedup
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._ack_batch_size = ack_batch_size
+        self._acks = AckBatcher(self._ack_batch_for(self.prefetch_count), ack_interval)
+        self.stats = ConsumerStats()
+        # Shared with other producers/consumers, or a private one closed by stop()
+        self.rabbit = connection or RabbitMQConnection(app_config)
+        self._owns_connection = connection is None
         self.connection = None
+        self._stopping = False
+        self._drained = False
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+        # Last task of every ordering key
+        self._tails: dict[Hashable, asyncio.Task] = {}
 
     async def connect(self, max_retries: int = 5, retry_delay: float = 2.0):
-        """ Connect to RabbitMQ with retries. """
-        tries = 0
-        while tries <= max_retries:
-            tries += 1
+        """ Connect to RabbitMQ with retries and consume until stopped. """
+        try:
+            await self.rabbit.connect(max_retries, retry_delay)
+        except Exception:
+            logger.error(f"Max retries reached. Failed to connect Consumer[{self.rabbit_config.queue}].")
+            raise
+        self.connection = self.rabbit.connection
+
+        self.channel = channel = await self.rabbit.channel()
+        try:
+            await channel.set_qos(prefetch_count=self.prefetch_count)
+            # Delivery tags start over on a reopened channel
+            channel.reopen_callbacks.add(lambda *_: self._acks.reset())
+
+            exchange = await self.rabbit.exchange(channel, self.rabbit_config.exchange, ExchangeType.DIRECT)
+            queue = await self.rabbit.queue(channel, self.rabbit_config.queue, durable=True)
+            await self.rabbit.bind(queue, exchange, self.rabbit_config.routing_key)
+            await self._declare_dead_letters(channel)
+            if self.dedup:
+                await self.dedup.start()
+
+            logger.info(f"[Consumer] {self.rabbit_config.queue} connected successfully.")
+
+            self._background = (asyncio.create_task(self._acks.run()),)
+            if self.flow:
+                self._background += (asyncio.create_task(self._adapt()),)
+            self._iterator = queue.iterator()
+            async for message in self._iterator:  # type: ignore
+                self._acks.track(message)
+                await self._dispatch(message)
+        finally:
+            # stop() finishes in-flight messages on the channel and closes it
+            if not self._stopping:
+                self._cancel_background()
+                if not channel.is_closed:
+                    await channel.close()
+
+    def _ack_batch_for(self, prefetch_count: int) -> int:
+        """ Unacked messages stop deliveries at prefetch_count, a batch must be ready before that """
+        return max(min(self._ack_batch_size, prefetch_count // 2), 1)
+
+    async def _adapt(self):
+        while True:
+            await asyncio.sleep(self.flow.interval)
+            prefetch_count = self.flow.next_prefetch(self.prefetch_count, self.stats)
+            if prefetch_count == self.prefetch_count:
+                continue
             try:
-                #
-                connection_task = asyncio.create_task(connect_robust(
-                    url=self.app_config.rabbitmq_url,  # type: ignore
-                    login=self.app_config.RABBITMQ_USER,  # type: ignore
-                    password=self.app_config.RABBITMQ_PASSWORD  # type: ignore
-                ))
-                timeout_task = asyncio.create_task(asyncio.wait_for(connection_task, 5))
-                try:
-                    await timeout_task
-                except asyncio.TimeoutError:
-                    raise TimeoutError(f"Failed to connect to RabbitMQ, timeout")
-                else:
-                    self.connection = connection_task.result()
-                    break
+                await self.channel.set_qos(prefetch_count=prefetch_count)
             except Exception as e:
-                logger.warning(f"Connection attempt {tries}/{max_retries} failed: {e}")
-                if tries < max_retries:
-                    await asyncio.sleep(retry_delay)
-                else:
-                    logger.error(f"Max retries reached. Failed to connect Consumer[{self.rabbit_config.queue}].")
-                    raise
+                logger.warning(f"Failed to set prefetch of {self.rabbit_config.queue}: {e}")
+                continue
+            logger.debug(
+                "Prefetch of {} changed {} -> {}", self.rabbit_config.queue, self.prefetch_count, prefetch_count
+            )
+            self.prefetch_count = prefetch_count
+            self._acks.batch_size = self._ack_batch_for(prefetch_count)
 
-        async with self.connection:
-            channel = await self.connection.channel()
-            await channel.set_qos(prefetch_count=1)
+    def _cancel_background(self) -> None:
+        for task in self._background:
+            task.cancel()
+        self._background = ()
 
-            exchange = await channel.declare_exchange(self.rabbit_config.exchange, ExchangeType.DIRECT)
-            queue = await channel.declare_queue(self.rabbit_config.queue, durable=True)
-            await queue.bind(exchange, routing_key=self.rabbit_config.routing_key)
+    async def _declare_dead_letters(self, channel: AbstractChannel):
+        dlx_name, dead_queue_name = dead_letter_names(self.rabbit_config.queue, self.rabbit_config.exchange)
+        self._dlx = await self.rabbit.exchange(channel, dlx_name, ExchangeType.DIRECT, durable=True)
+        dead_queue = await self.rabbit.queue(channel, dead_queue_name, durable=True)
+        # By queue name: queues sharing the exchange and routing key don't get each other's dead letters
+        await self.rabbit.bind(dead_queue, self._dlx, self.rabbit_config.queue)
 
-            logger.info(f"[Consumer] {self.rabbit_config.queue} connected successfully.")
+    async def _dispatch(self, message: AbstractIncomingMessage):
+        """ Waits for a free slot and processes the message in background """
+        await self._slots.acquire()
+        if self._drained:
+            # Too late, the broker redelivers it
+            self._slots.release()
+            return
+        key = self._ordering_key(message)
+        task = asyncio.create_task(self._run(message, self._tails.get(key) if key is not None else None))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if key is not None:
+            self._tails[key] = task
+            task.add_done_callback(lambda _: self._release_tail(key, task))
+
+    def _release_tail(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    def _ordering_key(self, message: AbstractIncomingMessage) -> Hashable | None:
+        if self.ordering_key is None:
+            return None
+        try:
+            return self.ordering_key(message)
+        except Exception as e:
+            logger.warning(f"Failed to get ordering key in {self.rabbit_config.queue}: {e}")
+            return None
+
+    async def _run(self, message: AbstractIncomingMessage, previous: asyncio.Task | None):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            self.stats.started()
+            started = perf_counter()
+            ok = await self._process_message(message)
+            self.stats.finished(perf_counter() - started, ok)
+        finally:
+            self._slots.release()
 
-            async for message in queue:  # type: ignore
-                await self._process_message(message)
+    def _dedup_key(self, message: AbstractIncomingMessage) -> str | None:
+        if self.dedup is None:
+            return None
+        try:
+            return self.dedup.key(message)
+        except Exception as e:
+            logger.warning(f"Failed to get dedup key in {self.rabbit_config.queue}: {e}")
+            return None
 
-    async def _process_message(self, message: AbstractIncomingMessage):
+    async def _process_message(self, message: AbstractIncomingMessage) -> bool:
         """ Processes incoming message and calls async message handler. """
+        key = self._dedup_key(message)
+        if key is None:
+            return await self._handle(message)
+        if not await self.dedup.claim(key, message.redelivered):
+            logger.debug("Duplicate message {} in {}", key, self.rabbit_config.queue)
+            await self._acks.ack(message)
+            return True
+        try:
+            return await self._handle(message, key)
+        finally:
+            self.dedup.release(key)
+
+    async def _handle(self, message: AbstractIncomingMessage, key: str | None = None) -> bool:
+        """ key: recorded in dedup once handled """
         try:
-            await message.ack()  # Подтверждаем обработку
             decoded_message = self._translate(message)
+        except Exception as e:
+            logger.error(f"Failed to decode message in {self.rabbit_config.queue} {e}")
+            await self._dead_letter(message, e)
+            return False
+        try:
             await self.message_handler(decoded_message)
         except Exception as e:
             logger.error(f"Error processing message in {self.rabbit_config.queue} {e}")
+            await self._retry(message, e)
+            return False
+        if key is not None:
+            await self.dedup.record(key)
+        await self._acks.ack(message)  # Подтверждаем обработку
+        return True
+
+    async def _retry(self, message: AbstractIncomingMessage, error: Exception):
+        attempt = attempt_of(message)
+        if attempt >= self.retry_policy.max_attempts:
+            await self._dead_letter(message, error)
+            return
+        try:
+            queue_name = await self._retry_queue(self.retry_policy.delay_ms(attempt))
+            await self.channel.default_exchange.publish(
+                copy_message(message, **{ATTEMPT_HEADER: attempt + 1}),
+                routing_key=queue_name,
+            )
+        except Exception as e:
+            logger.error(f"Failed to schedule retry in {self.rabbit_config.queue}: {e}")
+            await self._acks.nack(message, requeue=True)
+            return
+        await self._acks.ack(message)
+
+    async def _retry_queue(self, delay_ms: int) -> str:
+        """ Declares the delay queue once: expired messages go back to this queue only,
+        through the default exchange, not to every queue bound to the main exchange
+        """
+        name = retry_queue_name(self.rabbit_config.queue, delay_ms)
+        await self.rabbit.queue(self.channel, name, durable=True, arguments={
+            "x-message-ttl": delay_ms,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": self.rabbit_config.queue,
+        })
+        return name
+
+    async def _dead_letter(self, message: AbstractIncomingMessage, error: Exception):
+        try:
+            await self._dlx.publish(
+                copy_message(message, **{ERROR_HEADER: repr(error)[:1024]}),
+                routing_key=self.rabbit_config.queue,
+            )
+        except Exception as e:
+            logger.error(f"Failed to dead-letter message of {self.rabbit_config.queue}: {e}")
+            await self._acks.nack(message, requeue=True)
+            return
+        await self._acks.ack(message)
 
     def _translate(self, message: AbstractIncomingMessage) -> T:
-        return self.deserializer(message.body.decode())
+        return translate(message.body, message.content_type, message.content_encoding, self.deserializer, self.model)
+
+    async def stop(self, deadline: float = 30):
+        """ Stops the consumer and closes the connection to queue.
+        Stops fetching (prefetched messages go back to the queue), waits up to `deadline` seconds
+        for in-flight messages, flushes acks, then closes. Messages still running after the deadline are redelivered.
+        """
+        self._stopping = True
+        if self._iterator is not None:
+            try:
+                await self._iterator.close()
+            except Exception as e:
+                logger.warning(f"Failed to cancel consuming {self.rabbit_config.queue}: {e}")
+        await self._drain(deadline)
+        self._cancel_background()
+        await self._acks.flush()
+        if self.dedup:
+            await self.dedup.close()
+        if self._owns_connection:
+            await self.rabbit.close()
+        elif self.channel and not self.channel.is_closed:
+            # The shared connection stays open
+            await self.channel.close()
+        self.connection = None
 
-    async def stop(self):
-        """ Stops the consumer and closes the connection to queue. """
-        if self.connection:
-            await self.connection.close()
+    async def _drain(self, deadline: float):
+        loop = asyncio.get_running_loop()
+        until = loop.time() + deadline
+        # A finishing task may start another one (e.g. BatchConsumer flush)
+        while self._tasks and loop.time() < until:
+            await asyncio.wait(set(self._tasks), timeout=until - loop.time())
+            # Let the queue loop dispatch a message that was waiting for a free slot
+            await asyncio.sleep(0)
+        self._drained = True
+        if self._tasks:
+            logger.warning(f"{len(self._tasks)} messages of {self.rabbit_config.queue} not finished in {deadline}s")
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
 
     @property
     def is_alive(self) -> bool:
-        return self.connection is not None
+        """ Consuming: connected, the channel is open and stop() wasn't called """
+        return (
+            not self._stopping
+            and self.connection is not None and not self.connection.is_closed
+            and self.channel is not None and not self.channel.is_closed
+        )
 
 
 __all__ = [
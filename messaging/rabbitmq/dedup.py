@@ -0,0 +1,224 @@
+import asyncio
+import json
+import math
+from hashlib import blake2b
+from time import time
+from typing import Callable, TYPE_CHECKING
+
+from aio_pika.abc import AbstractIncomingMessage
+from loguru import logger
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+    from redis.asyncio.client import PubSub
+    from redis.asyncio.cluster import RedisCluster
+
+# Takes a message, returns its deduplication key (None - not deduplicated)
+DedupKey = Callable[[AbstractIncomingMessage], str | None]
+
+
+def payload_key(message: AbstractIncomingMessage) -> str:
+    """ Hash of the body: identical payloads are duplicates """
+    return blake2b(message.body, digest_size=16).hexdigest()
+
+
+def message_key(message: AbstractIncomingMessage) -> str:
+    """ message_id set by the publisher, the body hash without it """
+    return message.message_id or payload_key(message)
+
+
+class BloomFilter:
+    """ `key in bloom` is False for keys never added, a false positive happens with probability error_rate
+    once `capacity` keys are added
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str) -> list[int]:
+        # Double hashing: k positions out of two 64-bit halves of one digest
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class Deduplicator:
+    """ Remembers the keys of handled messages for `windows` time windows of `window` seconds.
+    The source of truth is a Redis set per window (`dedup:{name}:<window>`, expiring with the last one);
+    `redis` is a plain client, e.g. RedisCache.node(...).
+    A Bloom filter per window, fed by this process and by what other processes announce, answers
+    "never seen" without a round trip; Redis is asked only on a Bloom hit (a duplicate, or a false positive)
+    and for redelivered messages. Redis errors let the message through.
+    Not caught: a duplicate handled elsewhere before the announcement arrives, and two copies
+    handled by different processes at the same time.
+    """
+    _pubsub: 'PubSub | None' = None
+    _listener: asyncio.Task | None = None
+
+    def __init__(self,
+                 redis: 'Redis | RedisCluster',
+                 name: str,
+                 key: DedupKey = message_key,
+                 window: int = 600,
+                 windows: int = 6,
+                 capacity: int = 100_000,
+                 error_rate: float = 0.001):
+        """ capacity: expected keys per window """
+        self._redis = redis
+        self.name = name
+        self.key = key
+        self.window = window
+        self.windows = windows
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.channel = f"dedup:{name}"
+        self._filters: dict[int, BloomFilter] = {}
+        # Keys being handled in this process
+        self._in_flight: set[str] = set()
+        # Records finished in the same loop iteration share a round trip
+        self._unwritten: list[str] = []
+        self._written: asyncio.Future | None = None
+        self._background: set[asyncio.Task] = set()
+
+    def _current(self) -> int:
+        return int(time() // self.window)
+
+    def _redis_key(self, index: int) -> str:
+        # The name is a hash tag: all windows in one cluster slot
+        return f"dedup:{{{self.name}}}:{index}"
+
+    def _retained(self) -> range:
+        current = self._current()
+        return range(current - self.windows + 1, current + 1)
+
+    def _filter(self, index: int) -> BloomFilter:
+        bloom = self._filters.get(index)
+        if bloom is None:
+            bloom = self._filters[index] = BloomFilter(self.capacity, self.error_rate)
+            oldest = self._current() - self.windows + 1
+            for expired in [i for i in self._filters if i < oldest]:
+                del self._filters[expired]
+        return bloom
+
+    def _maybe_seen(self, key: str) -> bool:
+        return any(key in self._filters[index] for index in self._retained() if index in self._filters)
+
+    async def start(self) -> None:
+        """ Subscribe to announcements and load the retained keys, does nothing if started """
+        if self._pubsub is not None:
+            return
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        # Subscribed first, so a key recorded during the load is not lost
+        await self._load()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _load(self) -> None:
+        for index in self._retained():
+            key = self._redis_key(index)
+            bloom = self._filter(index)
+            async for member in self._redis.sscan_iter(key, count=1000):
+                bloom.add(member.decode())
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    bloom = self._filter(self._current())
+                    for key in json.loads(message["data"]):
+                        bloom.add(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Announcements may have been missed while disconnected
+                logger.warning(f"Dedup listener of {self.name} failed: {e}")
+                await asyncio.sleep(1)
+                try:
+                    await self._load()
+                except Exception as e:
+                    logger.warning(f"Failed to reload dedup keys of {self.name}: {e}")
+
+    async def close(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def claim(self, key: str, redelivered: bool = False) -> bool:
+        """ False if the key was handled already or is being handled now, otherwise it's in flight until release() """
+        if key in self._in_flight:
+            return False
+        if (redelivered or self._maybe_seen(key)) and await self._recorded(key):
+            return False
+        self._in_flight.add(key)
+        return True
+
+    async def _recorded(self, key: str) -> bool:
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for index in self._retained():
+                    pipe.sismember(self._redis_key(index), key)
+                return any(await pipe.execute())
+        except Exception as e:
+            logger.warning(f"Dedup check of {self.name} failed, handling the message: {e}")
+            return False
+
+    async def record(self, key: str) -> None:
+        """ The message is handled: remembered from now on, release() the key after """
+        self._filter(self._current()).add(key)
+        self._unwritten.append(key)
+        if self._written is None:
+            loop = asyncio.get_running_loop()
+            self._written = loop.create_future()
+            # After the other ready tasks, their records go in the same pipeline
+            loop.call_soon(self._flush)
+        try:
+            # Cancelling one caller must not cancel the write for the others
+            await asyncio.shield(self._written)
+        except Exception as e:
+            logger.warning(f"Failed to record dedup key of {self.name}: {e}")
+
+    def _flush(self) -> None:
+        keys, self._unwritten = self._unwritten, []
+        written, self._written = self._written, None
+        task = asyncio.create_task(self._store(keys, written))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def release(self, key: str) -> None:
+        """ Handling is over: recorded, or failed and a copy may be handled """
+        self._in_flight.discard(key)
+
+    async def _store(self, keys: list[str], written: asyncio.Future) -> None:
+        redis_key = self._redis_key(self._current())
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                pipe.sadd(redis_key, *keys)
+                pipe.expire(redis_key, self.window * self.windows)
+                pipe.publish(self.channel, json.dumps(keys))
+                await pipe.execute()
+        except Exception as e:
+            written.set_exception(e)
+        else:
+            written.set_result(None)
+
+
+__all__ = [
+    "BloomFilter",
+    "Deduplicator",
+    "DedupKey",
+    "message_key",
+    "payload_key",
+]
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from typing import Callable
+
+from messaging.rabbitmq.stats import ConsumerStats
+
+
+@dataclass(slots=True)
+class FlowControl:
+    """ AIMD prefetch: grows by `step` after every `interval` seconds in which messages were handled
+    within target_latency (an idle or stalled consumer keeps its prefetch), halves when
+    the p90 latency of the messages handled since the last check exceeds target_latency,
+    or when saturation() reports downstream pressure of 1 or more, e.g.
+    saturation=lambda: engine.pool.checkedout() / (engine.pool.size() + engine.pool.overflow())
+    Progress between checks is kept in the consumer's stats, one FlowControl may be shared by consumers.
+    """
+    min_prefetch: int = 1
+    max_prefetch: int = 1000
+    target_latency: float = 1.0
+    step: int = 1
+    interval: float = 1.0
+    saturation: Callable[[], float] | None = None
+
+    def next_prefetch(self, prefetch: int, stats: ConsumerStats) -> int:
+        handled = stats.handled
+        recent = min(handled - stats.checked, len(stats.latencies))
+        stats.checked = handled
+        latencies = list(stats.latencies)[len(stats.latencies) - recent:] if recent else []
+        if self._saturated() or self._too_slow(latencies):
+            return max(self.min_prefetch, prefetch // 2)
+        if not latencies:
+            return prefetch
+        return min(self.max_prefetch, max(self.min_prefetch, prefetch + self.step))
+
+    def _saturated(self) -> bool:
+        return self.saturation is not None and self.saturation() >= 1
+
+    def _too_slow(self, latencies: list[float]) -> bool:
+        if not latencies:
+            return False
+        latencies.sort()
+        return latencies[int(0.9 * (len(latencies) - 1))] > self.target_latency
+
+
+__all__ = [
+    "FlowControl",
+]
@@ -0,0 +1,421 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import count
+from typing import Any, Awaitable, Callable
+
+from aio_pika import ExchangeType, Message
+
+from messaging.rabbitmq.connection import RabbitMQConnection
+
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+
+class ChannelClosed(Exception):
+    pass
+
+
+class UnknownDeliveryTag(Exception):
+    """ RabbitMQ closes the channel with PRECONDITION_FAILED in this case """
+
+
+@dataclass(eq=False, slots=True)
+class Envelope:
+    """ A message stored in a queue, compared by identity """
+    body: bytes
+    headers: dict
+    properties: dict
+    exchange: str
+    routing_key: str
+    redelivered: bool = False
+    # Waiting in the queue / expired there (left in place, skipped when dequeued)
+    queued: bool = False
+    expired: bool = False
+
+
+class MemoryMessage:
+    """ The part of aio_pika IncomingMessage used by consumers """
+
+    def __init__(self, channel: 'MemoryChannel', queue: 'MemoryQueue | None', envelope: Envelope, delivery_tag: int):
+        self.channel = channel
+        self.queue = queue
+        self.envelope = envelope
+        self.delivery_tag = delivery_tag
+        self.body = envelope.body
+        self.headers = envelope.headers
+        self.exchange = envelope.exchange
+        self.routing_key = envelope.routing_key
+        self.redelivered = envelope.redelivered
+        self.content_type = envelope.properties.get("content_type")
+        self.content_encoding = envelope.properties.get("content_encoding")
+        self.correlation_id = envelope.properties.get("correlation_id")
+        self.reply_to = envelope.properties.get("reply_to")
+        self.message_id = envelope.properties.get("message_id")
+        self.timestamp = envelope.properties.get("timestamp")
+        self.type = envelope.properties.get("type")
+        self.delivery_mode = envelope.properties.get("delivery_mode")
+        self.priority = envelope.properties.get("priority")
+        self.expiration = envelope.properties.get("expiration")
+        self.user_id = envelope.properties.get("user_id")
+        self.app_id = envelope.properties.get("app_id")
+
+    async def ack(self, multiple: bool = False) -> None:
+        self.channel.settle(self.delivery_tag, multiple)
+
+    async def nack(self, requeue: bool = True, multiple: bool = False) -> None:
+        for queue, envelope in self.channel.settle(self.delivery_tag, multiple):
+            queue.reject(envelope, requeue)
+
+    async def reject(self, requeue: bool = False) -> None:
+        await self.nack(requeue=requeue)
+
+
+class MemoryExchange:
+    def __init__(self, broker: 'MemoryBroker', channel: 'MemoryChannel', name: str, type: ExchangeType):
+        self.broker = broker
+        self.channel = channel
+        self.name = name
+        self.type = type
+
+    async def publish(self, message: Message, routing_key: str, **kwargs) -> None:
+        """ Confirmed right away, unroutable messages are dropped """
+        self.channel.check_open()
+        properties = {
+            "content_type": message.content_type,
+            "content_encoding": message.content_encoding,
+            "correlation_id": message.correlation_id,
+            "reply_to": message.reply_to,
+            "message_id": message.message_id,
+            "timestamp": message.timestamp or datetime.now(),
+            "type": message.type,
+            "delivery_mode": message.delivery_mode,
+            "priority": message.priority,
+            "expiration": message.expiration,
+            "user_id": message.user_id,
+            "app_id": message.app_id,
+        }
+        if properties["reply_to"] == DIRECT_REPLY_TO:
+            properties["reply_to"] = self.channel.reply_to
+        self.broker.route(self.name, routing_key, Envelope(
+            message.body, dict(message.headers or {}), properties, self.name, routing_key,
+        ))
+
+
+class MemoryQueueIterator:
+    def __init__(self, queue: 'MemoryQueue', channel: 'MemoryChannel'):
+        self.queue = queue
+        self.channel = channel
+        self._buffer: asyncio.Queue[MemoryMessage | None] = asyncio.Queue()
+        self._consumer = Consumer(channel, self._buffer.put_nowait)
+        self._closed = False
+
+    def __aiter__(self) -> 'MemoryQueueIterator':
+        if not self._closed and self._consumer not in self.queue.consumers:
+            self.queue.add_consumer(self._consumer)
+        return self
+
+    async def __anext__(self) -> MemoryMessage:
+        message = await self._buffer.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def close(self) -> None:
+        """ Like aio-pika: cancels consuming and requeues buffered messages """
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.remove_consumer(self._consumer)
+        while not self._buffer.empty():
+            message = self._buffer.get_nowait()
+            if message is not None and not self.channel.is_closed:
+                await message.nack(requeue=True)
+        self._buffer.put_nowait(None)
+
+
+@dataclass(eq=False, slots=True)
+class Consumer:
+    channel: 'MemoryChannel'
+    deliver: Callable[[MemoryMessage], Any]
+    no_ack: bool = False
+
+
+class MemoryQueue:
+    def __init__(self, broker: 'MemoryBroker', name: str, arguments: dict | None = None):
+        self.broker = broker
+        self.name = name
+        self.arguments = arguments or {}
+        self.messages: deque[Envelope] = deque()
+        self.consumers: list[Consumer] = []
+        self._turn = count()
+
+    def add_consumer(self, consumer: Consumer) -> None:
+        self.consumers.append(consumer)
+        self.deliver()
+
+    def remove_consumer(self, consumer: Consumer) -> None:
+        if consumer in self.consumers:
+            self.consumers.remove(consumer)
+
+    def put(self, envelope: Envelope, front: bool = False) -> None:
+        envelope.queued = True
+        if front:
+            self.messages.appendleft(envelope)
+        else:
+            self.messages.append(envelope)
+        ttl = self.arguments.get("x-message-ttl")
+        if ttl is not None and not front:
+            asyncio.get_running_loop().call_later(ttl / 1000, self._expire, envelope)
+        self.deliver()
+
+    def _expire(self, envelope: Envelope) -> None:
+        # Delivered ones are gone already
+        if envelope.queued:
+            envelope.queued = False
+            envelope.expired = True
+            # Per-queue TTL expires in FIFO order: usually the head, queues without consumers are trimmed too
+            self._drop_expired()
+            self.dead_letter(envelope)
+
+    def _drop_expired(self) -> None:
+        while self.messages and self.messages[0].expired:
+            self.messages.popleft()
+
+    def reject(self, envelope: Envelope, requeue: bool) -> None:
+        if requeue:
+            envelope.redelivered = True
+            self.put(envelope, front=True)
+        else:
+            self.dead_letter(envelope)
+
+    def dead_letter(self, envelope: Envelope) -> None:
+        exchange = self.arguments.get("x-dead-letter-exchange")
+        if exchange is None:
+            return
+        routing_key = self.arguments.get("x-dead-letter-routing-key", envelope.routing_key)
+        self.broker.route(exchange, routing_key, Envelope(
+            envelope.body, envelope.headers, envelope.properties, exchange, routing_key,
+        ))
+
+    def deliver(self) -> None:
+        """ Hands messages round-robin to consumers whose channel is below its prefetch """
+        while self.consumers:
+            self._drop_expired()
+            if not self.messages:
+                return
+            for _ in range(len(self.consumers)):
+                consumer = self.consumers[next(self._turn) % len(self.consumers)]
+                if consumer.no_ack or consumer.channel.has_capacity():
+                    break
+            else:
+                return
+            envelope = self.messages.popleft()
+            envelope.queued = False
+            message = consumer.channel.delivered(self, envelope, track=not consumer.no_ack)
+            consumer.deliver(message)
+
+
+class MemoryQueueHandle:
+    """ What declare_queue/get_queue return: the queue as seen from one channel """
+
+    def __init__(self, queue: MemoryQueue, channel: 'MemoryChannel'):
+        self._queue = queue
+        self.channel = channel
+        self.name = queue.name
+
+    async def bind(self, exchange: MemoryExchange | str, routing_key: str = "", **kwargs) -> None:
+        name = exchange if isinstance(exchange, str) else exchange.name
+        self._queue.broker.bindings.setdefault(name, set()).add((routing_key, self.name))
+
+    def iterator(self, **kwargs) -> MemoryQueueIterator:
+        return MemoryQueueIterator(self._queue, self.channel)
+
+    def __aiter__(self) -> MemoryQueueIterator:
+        return self.iterator().__aiter__()
+
+    async def consume(self, callback: Callable[[MemoryMessage], Awaitable[Any]], no_ack: bool = False, **kwargs) -> str:
+        def deliver(message: MemoryMessage) -> None:
+            task = asyncio.create_task(callback(message))
+            self.channel.tasks.add(task)
+            task.add_done_callback(self.channel.tasks.discard)
+
+        consumer = Consumer(self.channel, deliver, no_ack)
+        if self.name == DIRECT_REPLY_TO:
+            self.channel.reply_consumer = consumer
+        else:
+            self._queue.add_consumer(consumer)
+        return f"ctag.{id(consumer)}"
+
+    async def purge(self) -> None:
+        self._queue.messages.clear()
+
+    async def delete(self, **kwargs) -> None:
+        broker = self._queue.broker
+        broker.queues.pop(self.name, None)
+        for bindings in broker.bindings.values():
+            bindings.difference_update({binding for binding in bindings if binding[1] == self.name})
+
+
+class MemoryChannel:
+    def __init__(self, connection: 'MemoryConnection', number: int):
+        self.connection = connection
+        self.broker = connection.broker
+        self.number = number
+        self.prefetch_count = 0
+        self.is_closed = False
+        self.reopen_callbacks: set = set()
+        self.reply_to = f"{DIRECT_REPLY_TO}.{id(self)}"
+        self.reply_consumer: Consumer | None = None
+        self.tasks: set[asyncio.Task] = set()
+        # delivery tag -> (queue, envelope) of unacked messages, in delivery order
+        self._unacked: dict[int, tuple[MemoryQueue, Envelope]] = {}
+        self._tags = count(1)
+        self.default_exchange = MemoryExchange(self.broker, self, "", ExchangeType.DIRECT)
+        self.broker.channels[self.reply_to] = self
+
+    def check_open(self) -> None:
+        if self.is_closed:
+            raise ChannelClosed(f"Channel {self.number} is closed")
+
+    def has_capacity(self) -> bool:
+        return not self.is_closed and (not self.prefetch_count or len(self._unacked) < self.prefetch_count)
+
+    def delivered(self, queue: MemoryQueue | None, envelope: Envelope, track: bool = True) -> MemoryMessage:
+        tag = next(self._tags)
+        if track:
+            self._unacked[tag] = (queue, envelope)
+        return MemoryMessage(self, queue, envelope, tag)
+
+    def settle(self, tag: int, multiple: bool) -> list[tuple[MemoryQueue, Envelope]]:
+        self.check_open()
+        if tag not in self._unacked:
+            raise UnknownDeliveryTag(f"Unknown delivery tag {tag}")
+        tags = [t for t in self._unacked if t <= tag] if multiple else [tag]
+        settled = [self._unacked.pop(t) for t in tags]
+        for queue in {queue for queue, _ in settled}:
+            queue.deliver()
+        return settled
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs) -> None:
+        self.prefetch_count = prefetch_count
+        for queue in self.broker.queues.values():
+            queue.deliver()
+
+    async def declare_exchange(self, name: str, type: ExchangeType = ExchangeType.DIRECT, **kwargs) -> MemoryExchange:
+        self.check_open()
+        self.broker.exchanges.setdefault(name, ExchangeType(type))
+        return MemoryExchange(self.broker, self, name, type)
+
+    async def get_exchange(self, name: str, ensure: bool = True) -> MemoryExchange:
+        if ensure and name not in self.broker.exchanges:
+            raise KeyError(f"Exchange {name} not found")
+        return MemoryExchange(self.broker, self, name, self.broker.exchanges.get(name, ExchangeType.DIRECT))
+
+    async def declare_queue(self, name: str = "", arguments: dict | None = None, **kwargs) -> MemoryQueueHandle:
+        self.check_open()
+        name = name or f"amq.gen-{next(self.broker.names)}"
+        queue = self.broker.queues.setdefault(name, MemoryQueue(self.broker, name, arguments))
+        return MemoryQueueHandle(queue, self)
+
+    async def get_queue(self, name: str, ensure: bool = True) -> MemoryQueueHandle:
+        if name == DIRECT_REPLY_TO:
+            return MemoryQueueHandle(MemoryQueue(self.broker, name), self)
+        if ensure and name not in self.broker.queues:
+            raise KeyError(f"Queue {name} not found")
+        return MemoryQueueHandle(self.broker.queues.setdefault(name, MemoryQueue(self.broker, name)), self)
+
+    async def close(self) -> None:
+        """ Unacked messages go back to their queues """
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self.broker.channels.pop(self.reply_to, None)
+        for queue in self.broker.queues.values():
+            queue.consumers = [consumer for consumer in queue.consumers if consumer.channel is not self]
+        for queue, envelope in reversed(list(self._unacked.values())):
+            queue.reject(envelope, requeue=True)
+        self._unacked.clear()
+        for task in self.tasks:
+            task.cancel()
+
+
+class MemoryConnection:
+    def __init__(self, broker: 'MemoryBroker'):
+        self.broker = broker
+        self.is_closed = False
+        self.channels: list[MemoryChannel] = []
+
+    async def channel(self, publisher_confirms: bool = True, **kwargs) -> MemoryChannel:
+        channel = MemoryChannel(self, len(self.channels) + 1)
+        self.channels.append(channel)
+        return channel
+
+    async def close(self) -> None:
+        self.is_closed = True
+        for channel in self.channels:
+            await channel.close()
+
+
+@dataclass(slots=True)
+class MemoryBroker:
+    """ In-process stand-in for RabbitMQ with the semantics used by Producer/Consumer:
+    direct and fanout exchanges, the default exchange, prefetch, acks (multiple too), nack/requeue,
+    requeue of unacked messages on channel close, per-queue TTL with dead-lettering
+    and direct reply-to. Publishes are confirmed immediately, message expiration is not emulated.
+    """
+    exchanges: dict[str, ExchangeType] = field(default_factory=dict)
+    queues: dict[str, MemoryQueue] = field(default_factory=dict)
+    # exchange -> {(routing key, queue)}
+    bindings: dict[str, set[tuple[str, str]]] = field(default_factory=dict)
+    # reply-to address -> channel
+    channels: dict[str, MemoryChannel] = field(default_factory=dict)
+    names: count = field(default_factory=count)
+
+    def connect(self) -> MemoryConnection:
+        return MemoryConnection(self)
+
+    def route(self, exchange: str, routing_key: str, envelope: Envelope) -> None:
+        if not exchange:
+            if routing_key.startswith(DIRECT_REPLY_TO):
+                self._reply(routing_key, envelope)
+            elif routing_key in self.queues:
+                self.queues[routing_key].put(envelope)
+            return
+        fanout = self.exchanges.get(exchange) == ExchangeType.FANOUT
+        for key, queue in self.bindings.get(exchange, ()):
+            if fanout or key == routing_key:
+                self.queues[queue].put(Envelope(
+                    envelope.body, envelope.headers, envelope.properties, exchange, routing_key,
+                ))
+
+    def _reply(self, address: str, envelope: Envelope) -> None:
+        channel = self.channels.get(address)
+        if channel is None or channel.reply_consumer is None:
+            return
+        channel.reply_consumer.deliver(channel.delivered(None, envelope, track=False))
+
+    def depth(self, queue: str) -> int:
+        """ Messages waiting in the queue, not delivered yet """
+        if queue not in self.queues:
+            return 0
+        return sum(not envelope.expired for envelope in self.queues[queue].messages)
+
+
+class InMemoryConnection(RabbitMQConnection):
+    """ RabbitMQConnection to a MemoryBroker, pass it as `connection` to producers and consumers """
+
+    def __init__(self, broker: MemoryBroker | None = None, pool_size: int = 1):
+        super().__init__(None, pool_size)
+        self.broker = broker or MemoryBroker()
+
+    async def _connect(self) -> MemoryConnection:  # type: ignore[override]
+        return self.broker.connect()
+
+
+__all__ = [
+    "MemoryBroker",
+    "InMemoryConnection",
+    "MemoryMessage",
+    "UnknownDeliveryTag",
+]
@@ -0,0 +1,204 @@
+import asyncio
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, TYPE_CHECKING
+
+from aio_pika.abc import AbstractIncomingMessage
+from loguru import logger
+
+from messaging.rabbitmq.connection import RabbitMQConnection
+from messaging.rabbitmq.consumer import Consumer, RabbitMQConfig, translate
+from messaging.rabbitmq.retry import RetryPolicy
+from settings.project_settings import RabbitMQSettings
+
+if TYPE_CHECKING:
+    from messaging.rabbitmq.dedup import Deduplicator
+
+
+class DecodeError(Exception):
+    """ Raised in a worker when the body can't be decoded, such messages are dead-lettered without retries """
+
+
+def _work(
+        handler: Callable[[Any], Any],
+        deserializer: Callable[[str], Any] | None,
+        model: type | None,
+        body: bytes,
+        content_type: str | None,
+        content_encoding: str | None,
+) -> None:
+    """ Runs in a worker process """
+    try:
+        data = translate(body, content_type, content_encoding, deserializer, model)
+    except Exception as e:
+        raise DecodeError(repr(e))
+    if inspect.iscoroutinefunction(handler):
+        asyncio.run(handler(data))
+    else:
+        handler(data)
+
+
+class _TrackingContext:
+    """ Multiprocessing context that remembers the processes it starts: the executor has no API to stop them """
+
+    def __init__(self, context):
+        self._context = context
+        self.processes: list[BaseProcess] = []
+
+    def Process(self, *args, **kwargs) -> BaseProcess:
+        # Exited ones (e.g. after max_tasks_per_child) are not needed anymore
+        self.processes = [process for process in self.processes if process.exitcode is None]
+        process = self._context.Process(*args, **kwargs)
+        self.processes.append(process)
+        return process
+
+    def __getattr__(self, name: str):
+        return getattr(self._context, name)
+
+
+async def _terminate(processes: list[BaseProcess], grace: float) -> None:
+    """ SIGTERM, then SIGKILL to those still alive after `grace` seconds """
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    loop = asyncio.get_running_loop()
+    until = loop.time() + grace
+    while any(process.is_alive() for process in processes) and loop.time() < until:
+        await asyncio.sleep(0.1)
+    for process in processes:
+        if process.is_alive():
+            logger.warning(f"Worker {process.pid} ignored SIGTERM, killing it")
+            process.kill()
+
+
+class ProcessConsumer[T](Consumer[T]):
+    """ Runs decoding and the handler in a pool of `workers` processes, for CPU-bound handlers.
+    The handler, deserializer and model must be picklable (module-level functions and classes);
+    an async handler gets its own event loop in the worker.
+    Every worker gets one message at a time, up to `queue_depth` more wait in the prefetch buffer.
+    If a message is not handled within `timeout` seconds it's retried and the pool is replaced, the old processes
+    are terminated (killed after `terminate_grace` seconds): messages queued or running there are retried too.
+    """
+    terminate_grace: float = 5
+
+    def __init__(self,
+                 app_config: [RabbitMQSettings],
+                 rabbit_config: RabbitMQConfig,
+                 message_handler: Callable[[T], Any],
+                 deserializer: Callable[[str], T] | None = None,
+                 workers: int | None = None,
+                 queue_depth: int | None = None,
+                 timeout: float = 60,
+                 max_tasks_per_child: int | None = None,
+                 retry_policy: RetryPolicy | None = None,
+                 connection: RabbitMQConnection | None = None,
+                 model: type[T] | None = None,
+                 dedup: 'Deduplicator | None' = None):
+        workers = workers or os.cpu_count() or 1
+        super().__init__(
+            app_config,
+            rabbit_config,
+            message_handler,
+            deserializer,
+            concurrency=workers,
+            prefetch_count=workers + (workers if queue_depth is None else queue_depth),
+            retry_policy=retry_policy,
+            connection=connection,
+            model=model,
+            dedup=dedup,
+        )
+        self.workers = workers
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self._pool: ProcessPoolExecutor | None = None
+        self._contexts: dict[ProcessPoolExecutor, _TrackingContext] = {}
+        self._terminating: set[asyncio.Task] = set()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # Same default as the executor: fork can't replace workers after max_tasks_per_child
+        context = _TrackingContext(multiprocessing.get_context("spawn" if self.max_tasks_per_child else None))
+        pool = ProcessPoolExecutor(self.workers, mp_context=context, max_tasks_per_child=self.max_tasks_per_child)
+        self._contexts[pool] = context
+        return pool
+
+    def _shutdown(self, pool: ProcessPoolExecutor) -> list[BaseProcess]:
+        """ Stops the pool taking work, returns its processes to terminate """
+        pool.shutdown(wait=False, cancel_futures=True)
+        return self._contexts.pop(pool).processes
+
+    async def connect(self, max_retries: int = 5, retry_delay: float = 2.0):
+        if self._pool is None:
+            self._pool = self._new_pool()
+        await super().connect(max_retries, retry_delay)
+
+    async def _handle(self, message: AbstractIncomingMessage, key: str | None = None) -> bool:
+        pool = self._pool
+        future = asyncio.get_running_loop().run_in_executor(
+            pool,
+            _work,
+            self.message_handler,
+            self.deserializer,
+            self.model,
+            message.body,
+            message.content_type,
+            message.content_encoding,
+        )
+        done, _ = await asyncio.wait([future], timeout=self.timeout)
+        if not done:
+            logger.error(f"Message in {self.rabbit_config.queue} not handled in {self.timeout}s, recycling workers")
+            # Nobody waits for it anymore
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._recycle(pool)
+            await self._retry(message, TimeoutError(f"Not handled in {self.timeout}s"))
+            return False
+        if future.cancelled():
+            # Queued in a pool that was replaced
+            await self._retry(message, RuntimeError("Worker pool was replaced"))
+            return False
+        try:
+            future.result()
+        except DecodeError as e:
+            logger.error(f"Failed to decode message in {self.rabbit_config.queue} {e}")
+            await self._dead_letter(message, e)
+            return False
+        except BrokenProcessPool as e:
+            logger.error(f"Worker of {self.rabbit_config.queue} died: {e}")
+            self._recycle(pool)
+            await self._retry(message, e)
+            return False
+        except Exception as e:
+            logger.error(f"Error processing message in {self.rabbit_config.queue} {e}")
+            await self._retry(message, e)
+            return False
+        if key is not None:
+            await self.dedup.record(key)
+        await self._acks.ack(message)
+        return True
+
+    def _recycle(self, pool: ProcessPoolExecutor) -> None:
+        """ Replaces the pool, unless another failure already did """
+        if pool is not self._pool:
+            return
+        self._pool = self._new_pool()
+        task = asyncio.create_task(_terminate(self._shutdown(pool), self.terminate_grace))
+        self._terminating.add(task)
+        task.add_done_callback(self._terminating.discard)
+
+    async def stop(self, deadline: float = 30):
+        await super().stop(deadline)
+        if self._pool is not None:
+            # Handlers still running after the deadline are redelivered anyway
+            await _terminate(self._shutdown(self._pool), self.terminate_grace)
+            self._pool = None
+        if self._terminating:
+            await asyncio.wait(set(self._terminating))
+
+
+__all__ = [
+    "ProcessConsumer",
+    "DecodeError",
+]
@@ -1,10 +1,13 @@
 import asyncio
 from dataclasses import dataclass
-from typing import Callable, Any
+from typing import Callable, Any, Iterable, Type
 
-from aio_pika import connect_robust, Message, ExchangeType, Connection, Channel, Exchange
+from aio_pika import Message, ExchangeType, Connection, Channel, Exchange
 from loguru import logger
 
+from messaging.rabbitmq.codecs import MessageCodec, MessageCompression, PydanticJsonCodec, encode_body
+from messaging.rabbitmq.connection import RabbitMQConnection
+
 from settings import RabbitMQSettings
 
 
@@ -16,48 +19,70 @@ class RabbitMQConfig:
 
 
 class Producer[T]:
-    def __init__(self, app_config: [RabbitMQSettings], rabbit_config: RabbitMQConfig, serializer: Callable[[T], Any]):
+    """ Publishes with publisher confirms: send() returns once the broker has confirmed the message.
+    Up to `max_outstanding` publishes wait for confirmation at once, spread over a pool of `channels` channels.
+    Data (after the optional serializer) is encoded by `codec`, and compressed when at least compress_min_size
+    bytes long; content_type/content_encoding tell the consumer how to decode it. Without a codec
+    str is sent as text like before codecs, bytes as is, anything else as JSON.
+    """
+
+    def __init__(self,
+                 app_config: [RabbitMQSettings],
+                 rabbit_config: RabbitMQConfig,
+                 serializer: Callable[[T], Any] | None = None,
+                 channels: int = 1,
+                 max_outstanding: int = 256,
+                 connection: RabbitMQConnection | None = None,
+                 codec: Type[MessageCodec] | None = None,
+                 compression: Type[MessageCompression] | None = None,
+                 compress_min_size: int = 1024):
         self.app_config = app_config
         self.rabbit_config = rabbit_config
         self.serializer = serializer
+        self.codec = codec
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.channels = channels
+        # Shared with other producers/consumers, or a private one closed by stop()
+        self.rabbit = connection or RabbitMQConnection(app_config)
+        self._owns_connection = connection is None
         self.connection: Connection | None = None
         self.channel: Channel | None = None
         self.exchange: Exchange | None = None
+        self._exchanges: list[Exchange] = []
+        self._turn = 0
+        self._window = asyncio.Semaphore(max_outstanding)
 
     async def connect(self, max_retries: int = 5, retry_delay: float = 2.0) -> None:
         """ Connect to RabbitMQ with retries. """
-        tries = 0
-        while tries <= max_retries:
-            tries += 1
-            try:
-                logger.info(f"Attempt {tries}/{max_retries} to connect Producer...")
-                self.connection = await connect_robust(
-                    url=self.app_config.rabbitmq_url,  # type: ignore
-                    login=self.app_config.RABBITMQ_USER,  # type: ignore
-                    password=self.app_config.RABBITMQ_PASSWORD  # type: ignore
-                )
-                self.channel = await self.connection.channel()
-                self.exchange = await self.channel.declare_exchange(
-                    self.rabbit_config.exchange, ExchangeType.DIRECT
-                )
-                logger.info(f"Producer[{self.rabbit_config.routing_key}] connected successfully.")
-                break
-            except Exception as e:
-                logger.warning(f"Connection attempt {tries}/{max_retries} failed: {e}")
-                if tries < max_retries:
-                    await asyncio.sleep(retry_delay)
-                else:
-                    logger.error("Max retries reached. Failed to connect Producer.")
-                    raise
+        try:
+            await self.rabbit.connect(max_retries, retry_delay)
+        except Exception:
+            logger.error("Max retries reached. Failed to connect Producer.")
+            raise
+        self.connection = self.rabbit.connection
+        self._exchanges = []
+        for _ in range(self.channels):
+            self.channel = await self.rabbit.channel(publisher_confirms=True)
+            self._exchanges.append(await self.rabbit.exchange(
+                self.channel, self.rabbit_config.exchange, ExchangeType.DIRECT
+            ))
+        self.exchange = self._exchanges[0]
+        logger.info(f"Producer[{self.rabbit_config.routing_key}] connected successfully.")
 
     async def stop(self) -> None:
         """ Stops the producer and closes the connection to queue."""
-        if self.connection:
-            await self.connection.close()
+        if self._owns_connection:
+            await self.rabbit.close()
             logger.info("Producer connection closed.")
+        else:
+            for exchange in self._exchanges:
+                if not exchange.channel.is_closed:
+                    await exchange.channel.close()
         self.connection = None
         self.channel = None
         self.exchange = None
+        self._exchanges = []
 
     async def send(self, data: T) -> None:
         """ Sends a message to queue. """
@@ -65,18 +90,63 @@ class Producer[T]:
             logger.warning("Producer is not connected. Attempting to reconnect...")
             await self.connect()
 
-        encoded_message = self.serialize(data)
+        message = self._message(data)
+        await self._window.acquire()
         try:
-            await self.exchange.publish(
-                Message(encoded_message.encode()),
-                routing_key=self.rabbit_config.routing_key
-            )
-            logger.debug(f"Message sent: {data}")
+            await self._publish(message)
         except Exception as e:
             logger.error(f"Failed to send message: {e}", exc_info=True)
             raise
+        logger.debug("Message sent: {}", data)
+
+    async def send_many(self, items: Iterable[T]) -> None:
+        """ Publishes items pipelined, returns when all of them are confirmed.
+        Raises the first publish error after the rest are done.
+        """
+        if not self.connection or not self.exchange:
+            logger.warning("Producer is not connected. Attempting to reconnect...")
+            await self.connect()
+
+        pending: set[asyncio.Task] = set()
+        errors: list[BaseException] = []
+        count = 0
+        for count, data in enumerate(items, 1):
+            message = self._message(data)
+            await self._window.acquire()
+            task = asyncio.create_task(self._publish(message))
+            pending.add(task)
+            task.add_done_callback(lambda t: self._collect(t, pending, errors))
+        await asyncio.gather(*pending, return_exceptions=True)
+        if errors:
+            logger.error(f"Failed to send {len(errors)} messages: {errors[0]}")
+            raise errors[0]
+        logger.debug("Messages sent: {}", count)
+
+    @staticmethod
+    def _collect(task: asyncio.Task, pending: set[asyncio.Task], errors: list[BaseException]) -> None:
+        pending.discard(task)
+        if not task.cancelled() and task.exception():
+            errors.append(task.exception())
+
+    async def _publish(self, message: Message) -> None:
+        """ Takes a window slot acquired by the caller and releases it on confirmation """
+        try:
+            exchange = self._exchanges[self._turn % len(self._exchanges)]
+            self._turn += 1
+            await exchange.publish(message, routing_key=self.rabbit_config.routing_key)
+        finally:
+            self._window.release()
+
+    def _message(self, data: T) -> Message:
+        payload = self.serialize(data) if self.serializer else data
+        if self.codec is None and isinstance(payload, str):
+            return Message(payload.encode())
+        body, content_type, content_encoding = encode_body(
+            payload, self.codec or PydanticJsonCodec, self.compression, self.compress_min_size
+        )
+        return Message(body, content_type=content_type, content_encoding=content_encoding)
 
-    def serialize(self, data: T) -> str:
+    def serialize(self, data: T) -> Any:
         """ Prepares data for sending. """
         try:
             return self.serializer(data)
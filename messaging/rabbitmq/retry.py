@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+
+from aio_pika import Message
+from aio_pika.abc import AbstractIncomingMessage
+
+ATTEMPT_HEADER = "x-attempt"
+ERROR_HEADER = "x-error"
+
+
+@dataclass(frozen=True, slots=True)
+class RetryPolicy:
+    """ Failed messages wait in {queue}.retry.{delay_ms} (a queue with message TTL, dead-lettered back into
+    {queue} through the default exchange), the delay grows by `factor` with every attempt.
+    After max_attempts the message goes to {exchange}.dlx with the queue name as routing key
+    and ends up in {queue}.dead
+    """
+    max_attempts: int = 5
+    base_delay_ms: int = 1000
+    factor: float = 2.0
+    max_delay_ms: int = 60_000
+
+    def delay_ms(self, attempt: int) -> int:
+        """ Delay before the attempt following `attempt` """
+        return min(int(self.base_delay_ms * self.factor ** (attempt - 1)), self.max_delay_ms)
+
+
+def retry_queue_name(queue: str, delay_ms: int) -> str:
+    return f"{queue}.retry.{delay_ms}"
+
+
+def dead_letter_names(queue: str, exchange: str) -> tuple[str, str]:
+    """ Return (exchange, queue) names of the dead letters """
+    return f"{exchange}.dlx", f"{queue}.dead"
+
+
+def attempt_of(message: AbstractIncomingMessage) -> int:
+    return int((message.headers or {}).get(ATTEMPT_HEADER, 1))
+
+
+def copy_message(message: AbstractIncomingMessage, **headers) -> Message:
+    """ Republishable copy of a received message with all its properties and extra headers """
+    return Message(
+        message.body,
+        headers={**(message.headers or {}), **headers},
+        content_type=message.content_type,
+        content_encoding=message.content_encoding,
+        delivery_mode=message.delivery_mode,
+        priority=message.priority,
+        correlation_id=message.correlation_id,
+        reply_to=message.reply_to,
+        expiration=message.expiration,
+        message_id=message.message_id,
+        timestamp=message.timestamp,
+        type=message.type,
+        user_id=message.user_id,
+        app_id=message.app_id,
+    )
+
+
+__all__ = [
+    "RetryPolicy",
+    "ATTEMPT_HEADER",
+    "ERROR_HEADER",
+    "retry_queue_name",
+    "dead_letter_names",
+    "attempt_of",
+    "copy_message",
+]
@@ -0,0 +1,129 @@
+import asyncio
+from typing import Any, Callable, Type
+from uuid import uuid4
+
+from aio_pika import Message
+from aio_pika.abc import AbstractIncomingMessage
+from loguru import logger
+
+from messaging.rabbitmq.codecs import MessageCodec, PydanticJsonCodec, encode_body
+from messaging.rabbitmq.consumer import Consumer, translate
+from messaging.rabbitmq.producer import Producer
+from messaging.rabbitmq.retry import ERROR_HEADER
+
+# RabbitMQ pseudo-queue: replies go straight to the consuming channel, no reply queue is declared
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+
+class RpcError(Exception):
+    """ The server failed to handle the request """
+
+
+class RpcServer[T](Consumer[T]):
+    """ Consumer whose handler result is sent back to the caller (reply_to, correlation_id).
+    A failed request is answered with an error instead of being retried, the caller is waiting for it.
+    Replies are encoded by `reply_codec`.
+    No dedup: a duplicate request would be acked without a reply, its caller waits for one.
+    """
+
+    def __init__(self, *args, reply_codec: Type[MessageCodec] = PydanticJsonCodec, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.dedup is not None:
+            raise ValueError("RpcServer doesn't support dedup, every request must be answered")
+        self.reply_codec = reply_codec
+
+    async def _process_message(self, message: AbstractIncomingMessage) -> bool:
+        try:
+            result = await self.message_handler(self._translate(message))
+        except Exception as e:
+            logger.error(f"Error processing request in {self.rabbit_config.queue} {e}")
+            await self._reply(message, error=e)
+            await self._acks.ack(message)
+            return False
+        await self._reply(message, result)
+        await self._acks.ack(message)
+        return True
+
+    async def _reply(self, message: AbstractIncomingMessage, result: Any = None, error: Exception | None = None):
+        if not message.reply_to:
+            return
+        if error is None:
+            body, content_type, content_encoding = encode_body(result, self.reply_codec)
+            reply = Message(body, content_type=content_type, content_encoding=content_encoding)
+        else:
+            reply = Message(b"", headers={ERROR_HEADER: repr(error)[:1024]})
+        reply.correlation_id = message.correlation_id
+        try:
+            await self.channel.default_exchange.publish(reply, routing_key=message.reply_to)
+        except Exception as e:
+            # The caller times out
+            logger.error(f"Failed to reply to {message.reply_to}: {e}")
+
+
+class RpcClient[T](Producer[T]):
+    """ Producer that waits for the reply: `await client.call(request)`.
+    Replies come through direct reply-to on the publishing channel, matched to callers by correlation id,
+    so any number of calls share one channel. Requests expire in the queue after the call timeout.
+    """
+
+    def __init__(self, *args, timeout: float = 5, **kwargs):
+        kwargs["channels"] = 1  # direct reply-to delivers to the channel that published
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+        self._calls: dict[str, asyncio.Future] = {}
+
+    async def connect(self, max_retries: int = 5, retry_delay: float = 2.0) -> None:
+        await super().connect(max_retries, retry_delay)
+        reply_queue = await self.channel.get_queue(DIRECT_REPLY_TO, ensure=False)
+        await reply_queue.consume(self._on_reply, no_ack=True)
+
+    async def _on_reply(self, message: AbstractIncomingMessage) -> None:
+        future = self._calls.get(message.correlation_id)
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    async def call(
+            self,
+            data: T,
+            model: type | None = None,
+            deserializer: Callable[[str], Any] | None = None,
+            timeout: float | None = None,
+    ) -> Any:
+        """ Return the reply decoded into model (plain data if None), raises RpcError or TimeoutError """
+        if not self.connection or not self.exchange:
+            logger.warning("RpcClient is not connected. Attempting to reconnect...")
+            await self.connect()
+
+        timeout = timeout or self.timeout
+        correlation_id = uuid4().hex
+        message = self._message(data)
+        message.correlation_id = correlation_id
+        message.reply_to = DIRECT_REPLY_TO
+        message.expiration = timeout
+        future = self._calls[correlation_id] = asyncio.get_running_loop().create_future()
+        try:
+            async with asyncio.timeout(timeout):
+                await self._window.acquire()
+                await self._publish(message)
+                reply: AbstractIncomingMessage = await future
+        finally:
+            self._calls.pop(correlation_id, None)
+        error = (reply.headers or {}).get(ERROR_HEADER)
+        if error is not None:
+            raise RpcError(error)
+        return translate(reply.body, reply.content_type, reply.content_encoding, deserializer, model)
+
+    async def stop(self) -> None:
+        for future in self._calls.values():
+            if not future.done():
+                future.cancel()
+        self._calls.clear()
+        await super().stop()
+
+
+__all__ = [
+    "RpcServer",
+    "RpcClient",
+    "RpcError",
+    "DIRECT_REPLY_TO",
+]
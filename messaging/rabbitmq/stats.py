@@ -0,0 +1,62 @@
+from collections import deque
+from dataclasses import dataclass, field
+
+
+@dataclass(slots=True)
+class ConsumerStats:
+    """ Counters of a consumer, latency percentiles are taken over the last `window` handled messages """
+    window: int = 1024
+    in_flight: int = 0
+    max_in_flight: int = 0
+    processed: int = 0
+    failed: int = 0
+    latencies: deque[float] = field(default_factory=deque)
+    # Handled messages at the last FlowControl check
+    checked: int = 0
+
+    def __post_init__(self):
+        self.latencies = deque(self.latencies, maxlen=self.window)
+
+    @property
+    def handled(self) -> int:
+        return self.processed + self.failed
+
+    def started(self) -> None:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finished(self, seconds: float, ok: bool = True) -> None:
+        self.in_flight -= 1
+        self.latencies.append(seconds)
+        if ok:
+            self.processed += 1
+        else:
+            self.failed += 1
+
+    def finished_batch(self, seconds: float, processed: int, failed: int) -> None:
+        self.in_flight -= 1
+        self.latencies.append(seconds)
+        self.processed += processed
+        self.failed += failed
+
+    def percentile(self, q: float) -> float | None:
+        """ q in [0, 1], None until something was handled """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "latency_p50": self.percentile(0.5),
+            "latency_p99": self.percentile(0.99),
+        }
+
+
+__all__ = [
+    "ConsumerStats",
+]
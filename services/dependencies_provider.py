@@ -1,7 +1,10 @@
+import asyncio
+
 from loguru import logger
 
 from cache import AbstractCache
-from messaging import Producer, Consumer
+from cache.warmup import CacheWarmUp
+from messaging import Producer, Consumer, RabbitMQConnection
 from services.abs import AbstractService
 
 
@@ -12,9 +15,10 @@ class DependenciesProvider:
     mongo_repos: list
     cache: AbstractCache
     rabbits: list[Consumer | Producer]
-
-    def __init__(self):
-        pass
+    # Shared by the rabbits created with connection=dp.rabbit_connection
+    rabbit_connection: RabbitMQConnection | None = None
+    # Optional, run after services are initialized and before rabbits connect
+    warmup: CacheWarmUp | None = None
 
     async def post_init(self):
         for service in self.services:
@@ -22,12 +26,25 @@ class DependenciesProvider:
                 await service.initialize()
             except Exception as e:
                 logger.error(f"Failed to initialize service {service.__class__.__name__}: {e}")
+        if self.warmup:
+            # Bounded by the warm-up budget, failures are logged per stage
+            await self.warmup.run()
+        if self.rabbit_connection:
+            try:
+                await self.rabbit_connection.connect()
+            except Exception as e:
+                logger.error(f"Failed to connect to RabbitMQ: {e}")
         for rabbit in self.rabbits:
             try:
                 await rabbit.connect()
             except Exception as e:
                 logger.error(f"Failed to connect rabbit {rabbit.__class__.__name__}: {e}")
 
+    @property
+    def ready(self) -> asyncio.Event | None:
+        """ The warm-up's event: set once it's over, None without a warm-up """
+        return self.warmup.ready if self.warmup else None
+
     async def dispose(self):
         logger.info("Disposing services...")
         for service in self.services:
@@ -37,6 +54,8 @@ class DependenciesProvider:
                 logger.error(f"Failed to dispose service {service.__class__.__name__}: {e}")
         for rabbit in self.rabbits:
             await rabbit.stop()
+        if self.rabbit_connection:
+            await self.rabbit_connection.close()
 
 
 dp = DependenciesProvider()
@@ -59,6 +59,10 @@ class RedisSettings(_Settings):
     REDIS_USER: str = Field(default="guest", env="REDIS_USER")
     REDIS_PASSWORD: str = Field(default="guest", env="REDIS_PASSWORD")
     REDIS_DB_NUMBER: int = Field(default=0, env="REDIS_DB_NUMBER")
+    # Shards for client-side consistent hashing ("redis://host:port/db"), empty for a single node
+    REDIS_NODES: list[str] = Field(default=[], env="REDIS_NODES")
+    # Connect to REDIS_ADDRESS as a Redis Cluster
+    REDIS_CLUSTER: bool = Field(default=False, env="REDIS_CLUSTER")
 
     DROP_CACHE: bool = Field(default=False, env="DROP_CACHE")
 
@@ -66,6 +70,10 @@ class RedisSettings(_Settings):
     def redis_url(self):
         return f"redis://{self.REDIS_ADDRESS}/{self.REDIS_DB_NUMBER}"
 
+    @property
+    def redis_urls(self) -> list[str]:
+        return self.REDIS_NODES or [self.redis_url]
+
     @property
     def redis_url_with_user(self):
         return f"redis://{self.REDIS_USER}:{self.REDIS_PASSWORD}@{self.REDIS_ADDRESS}:{self.REDIS_PORT}"